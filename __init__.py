@@ -2,21 +2,27 @@ from __future__ import division
 
 import time
 import json
+import hashlib
 import datetime
 import math
+from collections import namedtuple
 
-from flask import Blueprint, request, Flask, render_template, url_for, redirect, flash
+from flask import Blueprint, request, Flask, Response, current_app, render_template, url_for, redirect, flash
 
-from CTFd.models import db, Solves
+from CTFd.models import db, Solves, Teams, Users
 from CTFd.plugins import register_plugin_assets_directory
+from CTFd.plugins.migrations import upgrade
 from CTFd.plugins.challenges import CHALLENGE_CLASSES, BaseChallenge
+from CTFd.exceptions.challenges import ChallengeCreateException, ChallengeUpdateException
 from CTFd.utils.decorators import authed_only, admins_only, during_ctf_time_only, ratelimit, require_verified_emails
 from CTFd.utils.user import get_current_user
 from CTFd.utils.modes import get_model
 from CTFd.utils import get_config
 
-from .models import ContainerChallengeModel, ContainerInfoModel, ContainerSettingsModel
-from .container_manager import ContainerManager, ContainerException
+from .models import ContainerChallengeModel, ContainerInfoModel, ContainerLeaseModel, ContainerPoolModel, ContainerReplicaModel, ContainerSettingsModel
+from .container_manager import ContainerManager, ContainerException, CapacityException, SHARED_SPAWN_MODE, SPAWN_MODES, TEAM_SPAWN_MODE
+from .cache import TTLCache
+from .log import logger, setup_logging
 
 def get_settings_path():
     import os
@@ -27,6 +33,40 @@ settings = json.load(open(get_settings_path()))
 USERS_MODE = settings["modes"]["USERS_MODE"]
 TEAMS_MODE = settings["modes"]["TEAMS_MODE"]
 
+# Seconds a cached challenge spec or user mode is trusted, bounding staleness after changes made in other workers
+CACHE_TTL = 30
+
+# The fields of a container challenge needed to answer player requests and spawn containers
+ChallengeSpec = namedtuple("ChallengeSpec", [
+    "id", "image", "port", "command", "volumes", "ctype", "server", "warm_pool_size",
+    "memory_limit", "cpu_limit", "pids_limit", "ulimits", "tmpfs", "storage_limit",
+    "spawn_mode", "replicas", "replica_teams"])
+
+# The container answering a team's (or user's) requests for a challenge, its own or a lease on a shared replica
+ContainerView = namedtuple("ContainerView", ["container_id", "server", "port", "expires", "shared"])
+
+# Resource profile fields of a container challenge and their types, an empty field falls back to the default
+RESOURCE_FIELDS = {
+    "memory_limit": int,
+    "cpu_limit": float,
+    "pids_limit": int,
+    "ulimits": str,
+    "tmpfs": str,
+    "storage_limit": int,
+}
+
+# Fields choosing between a container per team and shared replicas
+SPAWN_FIELDS = ("spawn_mode", "replicas", "replica_teams")
+
+plugin_cache = TTLCache(CACHE_TTL)
+
+# Paging of the admin container list, the browser asks for one page at a time
+RUNNING_CONTAINERS_PER_PAGE = 50
+RUNNING_CONTAINERS_MAX_PER_PAGE = 500
+RUNNING_CONTAINERS_SORTS = ("created", "expires", "challenge", "team", "server")
+# Seconds between keep-alive comments on an idle dashboard stream, below common proxy read timeouts
+STREAM_KEEPALIVE = 15
+
 
 class ContainerChallenge(BaseChallenge):
     id = settings["plugin-info"]["id"]  # Unique identifier used to register challenges
@@ -72,9 +112,33 @@ class ContainerChallenge(BaseChallenge):
                 "scripts": cls.scripts,
             },
             "server": challenge.server,
+            "warm_pool_size": challenge.warm_pool_size,
+            **{field: getattr(challenge, field) for field in RESOURCE_FIELDS},
+            "spawn_mode": challenge.spawn_mode or TEAM_SPAWN_MODE,
+            "replicas": challenge.replicas,
+            "replica_teams": challenge.replica_teams,
         }
         return data
 
+    @classmethod
+    def create(cls, request):
+        """
+        This method is used to process the challenge creation request.
+
+        :param request:
+        :return:
+        """
+        data = request.form.to_dict() or request.get_json()
+        try:
+            data = parse_challenge_fields(data)
+        except ContainerException as err:
+            raise ChallengeCreateException(str(err))
+
+        challenge = cls.challenge_model(**data)
+        db.session.add(challenge)
+        db.session.commit()
+        return challenge
+
     @classmethod
     def calculate_value(cls, challenge):
         Model = get_model()
@@ -121,6 +185,11 @@ class ContainerChallenge(BaseChallenge):
         :return:
         """
         data = request.form or request.get_json()
+        # Validate every field before any is set, so a rejected update leaves the challenge untouched
+        try:
+            data = parse_challenge_fields(data)
+        except ContainerException as err:
+            raise ChallengeUpdateException(str(err))
 
         for attr, value in data.items():
             # We need to set these to floats so that the next operations don't operate on strings
@@ -128,7 +197,27 @@ class ContainerChallenge(BaseChallenge):
                 value = float(value)
             setattr(challenge, attr, value)
 
-        return ContainerChallenge.calculate_value(challenge)
+        challenge = ContainerChallenge.calculate_value(challenge)
+        plugin_cache.invalidate(("challenge", challenge.id))
+        return challenge
+
+    @classmethod
+    def delete(cls, challenge):
+        # The rows of the challenge's containers go with it, kill the containers first so none keeps running unseen
+        containers = {container.container_id: container.server
+            for model in (ContainerInfoModel, ContainerPoolModel, ContainerReplicaModel)
+            for container in db.session.query(model.container_id, model.server).filter(model.challenge_id == challenge.id)}
+        if containers:
+            try:
+                results = current_app.extensions["containers"].kill_containers(containers)
+            except ContainerException as err:
+                results = {container_id: {"error": str(err)} for container_id in containers}
+            for container_id, result in results.items():
+                if "error" in result:
+                    logger.warning("Deleting challenge %s left container %s running: %s",
+                        challenge.id, container_id, result["error"])
+        plugin_cache.invalidate(("challenge", challenge.id))
+        super().delete(challenge)
 
     @classmethod
     def solve(cls, user, team, challenge, request):
@@ -142,8 +231,81 @@ def settings_to_dict(settings):
         setting.key: setting.value for setting in settings
     }
 
+def parse_challenge_fields(data) -> dict:
+    """Convert the submitted container fields of a challenge, raising ContainerException when one is invalid."""
+    fields = {}
+    for attr, value in data.items():
+        if attr in RESOURCE_FIELDS:
+            value = parse_resource_field(attr, value)
+        elif attr in SPAWN_FIELDS:
+            value = parse_spawn_field(attr, value)
+        elif attr == "warm_pool_size":
+            try:
+                value = int(value or 0)
+            except (TypeError, ValueError):
+                raise ContainerException("warm_pool_size must be a whole number")
+            if value < 0:
+                raise ContainerException("warm_pool_size must not be negative")
+        fields[attr] = value
+    return fields
+
+def parse_resource_field(attr: str, value) -> "int|float|str|None":
+    """Convert a submitted resource profile field, raising ContainerException when it is invalid."""
+    if value is None or value == "":
+        return None
+    if attr in ("ulimits", "tmpfs"):
+        # The API may send the JSON object itself rather than a string of it
+        if not isinstance(value, str):
+            value = json.dumps(value)
+        if attr == "ulimits":
+            ContainerManager.parse_ulimits(value)
+        else:
+            ContainerManager.parse_tmpfs(value)
+        return value
+    try:
+        value = RESOURCE_FIELDS[attr](value)
+    except (TypeError, ValueError):
+        raise ContainerException(f"{attr} must be a number")
+    if not math.isfinite(value):
+        raise ContainerException(f"{attr} must be a finite number")
+    if value < 0:
+        raise ContainerException(f"{attr} must not be negative")
+    return value
+
+def parse_spawn_field(attr: str, value) -> "int|str|None":
+    """Convert a submitted spawn mode field, raising ContainerException when it is invalid."""
+    if attr == "spawn_mode":
+        value = value or TEAM_SPAWN_MODE
+        if value not in SPAWN_MODES:
+            raise ContainerException(f"spawn_mode must be one of {', '.join(SPAWN_MODES)}")
+        return value
+    if value is None or value == "":
+        return None
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        raise ContainerException(f"{attr} must be a whole number")
+    if value < 1:
+        raise ContainerException(f"{attr} must be at least 1")
+    return value
+
+def get_challenge_spec(chal_id) -> "ChallengeSpec|None":
+    """Spawn-relevant fields of a container challenge, cached in-process and dropped when the challenge changes."""
+    try:
+        chal_id = int(chal_id)
+    except (TypeError, ValueError):
+        return None
+
+    def load_spec():
+        challenge = ContainerChallengeModel.query.filter_by(id=chal_id).first()
+        if challenge is None:
+            return None
+        return ChallengeSpec(**{field: getattr(challenge, field) for field in ChallengeSpec._fields})
+
+    return plugin_cache.get(("challenge", chal_id), load_spec)
+
 def is_team_mode():
-    mode = get_config("user_mode")
+    mode = plugin_cache.get("user_mode", lambda: get_config("user_mode"))
     if mode == TEAMS_MODE:
         return True
     elif mode == USERS_MODE:
@@ -151,8 +313,43 @@ def is_team_mode():
     else:
         return None
 
+def make_etag(*parts) -> str:
+    """Strong ETag over everything a response is built from."""
+    return hashlib.sha1(json.dumps(parts).encode()).hexdigest()
+
+def query_running_containers():
+    """Only the columns the admin container list shows, joined in one query instead of lazy-loading three relations per row."""
+    return db.session.query(
+        ContainerInfoModel.container_id, ContainerInfoModel.server, ContainerInfoModel.port,
+        ContainerInfoModel.timestamp, ContainerInfoModel.expires,
+        ContainerInfoModel.challenge_id, ContainerChallengeModel.name, ContainerChallengeModel.image,
+        ContainerInfoModel.user_id, Users.name, ContainerInfoModel.team_id, Teams.name,
+    ).outerjoin(ContainerChallengeModel, ContainerChallengeModel.id == ContainerInfoModel.challenge_id) \
+        .outerjoin(Users, Users.id == ContainerInfoModel.user_id) \
+        .outerjoin(Teams, Teams.id == ContainerInfoModel.team_id)
+
+def serialize_running_container(row, team_mode: bool, running: bool) -> dict:
+    (container_id, server, port, created, expires, chal_id, chal_name, image,
+     user_id, user_name, team_id, team_name) = row
+    container = {
+        "id": container_id,
+        "server": server,
+        "image": image,
+        "challenge": [chal_id, chal_name],
+        "user": [user_id, user_name],
+        "port": port,
+        "created": created,
+        "expires": expires,
+        "running": running,
+    }
+    if team_mode:
+        container["team"] = [team_id, team_name]
+    return container
+
 def load(app: Flask):
+    setup_logging()
     app.db.create_all()
+    upgrade(plugin_name="containers")
     CHALLENGE_CLASSES["container"] = ContainerChallenge
     register_plugin_assets_directory(
         app, base_path="/plugins/containers/assets/"
@@ -160,6 +357,25 @@ def load(app: Flask):
 
     container_settings = settings_to_dict(ContainerSettingsModel.query.all())
     container_manager = ContainerManager(container_settings, app)
+    # Lets tooling such as the benchmarks reach the manager of a running app
+    app.extensions["containers"] = container_manager
+
+    spawn_requests = container_manager.metrics.counter(
+        "ctfd_containers_spawn_requests_total", "Finished player container requests by outcome", ("status",))
+    spawn_request_latency = container_manager.metrics.histogram(
+        "ctfd_containers_spawn_request_seconds", "Time from a spawn job starting to its result", ("status",))
+
+    def warm_up_images():
+        def warm_up(job_id):
+            return json.dumps(container_manager.warm_up_images(job_id)), 200
+
+        return container_manager.enqueue_job(warm_up, kind="warmup")
+
+    # Optionally pre-pull every challenge image as soon as the plugin loads. Every CTFd worker loads the
+    # plugin, the lock is kept so only the first one to start pulls
+    if container_manager.client and container_settings.get("warmup_on_load") == "true" \
+            and container_manager.acquire_lock("warmup_on_load"):
+        warm_up_images()
 
     containers_bp = Blueprint(
         'containers', __name__, template_folder='templates', static_folder='assets', url_prefix='/containers')
@@ -175,24 +391,22 @@ def load(app: Flask):
             container_id=container_id).first()
 
         try:
-            container_manager.kill_container(container_id)
+            return container_manager.kill_container(
+                container_id, container.server if container is not None else "")
         except ContainerException:
             return {"error": "Docker is not initialized. Please check your settings."}
 
-        db.session.delete(container)
-
-        db.session.commit()
-        return {"success": "Container killed"}
-
     def renew_container(chal_id, xid, is_team):
         # Get the requested challenge
-        challenge = ContainerChallenge.challenge_model.query.filter_by(
-            id=chal_id).first()
+        challenge = get_challenge_spec(chal_id)
 
         # Make sure the challenge exists and is a container challenge
         if challenge is None:
             return {"error": "Challenge not found"}, 400
 
+        if challenge.spawn_mode == SHARED_SPAWN_MODE:
+            return renew_lease(challenge, xid, is_team)
+
         if is_team is True:
             running_containers = ContainerInfoModel.query.filter_by(
             challenge_id=challenge.id, team_id=xid)
@@ -207,55 +421,95 @@ def load(app: Flask):
         try:
             running_container.expires = int(
                 time.time() + container_manager.expiration_seconds)
+            container_manager.feed.record("renewed", [running_container.container_id], expires=running_container.expires)
             db.session.commit()
         except ContainerException:
             return {"error": "Database error occurred, please try again."}
 
-        return {"success": "Container renewed", "expires": running_container.expires, "hostname": container_manager.settings.get("docker_hostname", ""), "port": running_container.port, "connect": challenge.ctype}
+        return {"success": "Container renewed", "expires": running_container.expires, "hostname": container_manager.get_server_hostname(running_container.server), "port": running_container.port, "connect": challenge.ctype}
+
+    def renew_lease(challenge, xid, is_team):
+        leased = container_manager.get_lease(challenge.id, xid, is_team)
+        if leased is None:
+            return {"error": "Container not found, try resetting the container."}
+        replica, lease = leased
+
+        lease.expires = int(time.time() + container_manager.expiration_seconds)
+        db.session.commit()
+        return {"success": "Container renewed", "expires": lease.expires, "hostname": container_manager.get_server_hostname(replica.server), "port": replica.port, "connect": challenge.ctype}
+
+    def lease_shared_container(challenge, xid, uid, is_team):
+        # Shared challenges start no container per team, teams get a lease on one of the challenge's replicas
+        leased = container_manager.get_lease(challenge.id, xid, is_team)
+        if leased is not None:
+            replica, lease = leased
+            return json.dumps({
+                "status": "already_running",
+                "hostname": container_manager.get_server_hostname(replica.server),
+                "port": replica.port,
+                "connect": challenge.ctype,
+                "expires": lease.expires
+            })
+
+        expires = int(time.time() + container_manager.expiration_seconds)
+        try:
+            replica, lease = container_manager.lease_replica(challenge, xid if is_team else None, uid, expires)
+        except CapacityException as err:
+            return {"error": str(err), "retry_after": err.retry_after}, 503
+        except ContainerException as err:
+            return {"error": str(err)}
+
+        return json.dumps({
+            "status": "created",
+            "hostname": container_manager.get_server_hostname(replica.server),
+            "port": replica.port,
+            "connect": challenge.ctype,
+            "expires": expires
+        })
 
     def create_container(chal_id, xid, uid, is_team):
         # Get the requested challenge
-        challenge = ContainerChallenge.challenge_model.query.filter_by(
-            id=chal_id).first()
+        challenge = get_challenge_spec(chal_id)
 
         # Make sure the challenge exists and is a container challenge
         if challenge is None:
             return {"error": "Challenge not found"}, 400
-        hostname = json.loads(container_manager.settings.get("docker_servers","{}"))
-        for name,server_url in hostname.items():
-            if challenge.server == name:
-                hostname = server_url
-                if "unix://" in hostname:
-                    hostname = container_manager.settings.get("docker_hostname", "")
-                elif "ssh://" in hostname:
-                    hostname = hostname.split("@")[1]
         # Check if user already has MAX_CONTAINERS_ALLOWED number running containers.
         MAX_CONTAINERS_ALLOWED = settings["vars"]["MAX_CONTAINERS_ALLOWED"]
         if not is_team: uid = xid
-        t_containers = ContainerInfoModel.query.filter_by(
-            user_id=uid)
 
-        if t_containers.count() >= MAX_CONTAINERS_ALLOWED:
-            return { "error": f"You can only spawn {MAX_CONTAINERS_ALLOWED} containers at a time. Please stop other containers to continue" }, 500
+        if challenge.spawn_mode == SHARED_SPAWN_MODE:
+            return lease_shared_container(challenge, xid, uid, is_team)
 
-        # Check for any existing containers for the team
+        # Fetch the user's containers and the team's container for this challenge in one query served by the
+        # owner/challenge indexes. Below the limit the team's one container always fits in the extra row, and a
+        # truncated result still holds MAX_CONTAINERS_ALLOWED containers of the user
         if is_team is True:
-            running_containers = ContainerInfoModel.query.filter_by(
-                challenge_id=challenge.id, team_id=xid)
+            owner_filter = ContainerInfoModel.team_id == xid
         else:
-            running_containers = ContainerInfoModel.query.filter_by(
-                challenge_id=challenge.id, user_id=xid)           
-        running_container = running_containers.first()
+            owner_filter = ContainerInfoModel.user_id == xid
+        containers = ContainerInfoModel.query.filter(db.or_(
+            ContainerInfoModel.user_id == uid,
+            db.and_(ContainerInfoModel.challenge_id == challenge.id, owner_filter))) \
+            .limit(MAX_CONTAINERS_ALLOWED + 1).all()
+
+        if sum(1 for container in containers if container.user_id == uid) >= MAX_CONTAINERS_ALLOWED:
+            return { "error": f"You can only spawn {MAX_CONTAINERS_ALLOWED} containers at a time. Please stop other containers to continue" }, 500
+
+        # Check for any existing containers for the team
+        running_container = next((container for container in containers
+            if container.challenge_id == challenge.id
+            and (container.team_id if is_team is True else container.user_id) == xid), None)
 
         # If a container is already running for the team, return it
         if running_container:
             # Check if Docker says the container is still running before returning it
             try:
                 if container_manager.is_container_running(
-                        running_container.container_id):
+                        running_container.container_id, running_container.server):
                     return json.dumps({
                         "status": "already_running",
-                        "hostname": hostname,
+                        "hostname": container_manager.get_server_hostname(running_container.server),
                         "port": running_container.port,
                         "ssh_username": running_container.ssh_username,
                         "ssh_password": running_container.ssh_password,
@@ -265,108 +519,169 @@ def load(app: Flask):
                 else:
                     # Container is not running, it must have died or been killed,
                     # remove it from the database and create a new one
-                    running_containers.delete()
+                    ContainerInfoModel.query.filter_by(
+                        container_id=running_container.container_id).delete()
+                    container_manager.feed.record("killed", [running_container.container_id])
                     db.session.commit()
             except ContainerException as err:
                 return {"error": str(err)}, 500
 
-        # Run a new Docker container
-        try:
-            created_container = container_manager.create_container(
-                chal_id, xid, uid, challenge.image, challenge.port, challenge.command, challenge.volumes,challenge.server)
-        except ContainerException as err:
-            return {"error": str(err)}
-
-        # Fetch the random port Docker assigned
-        port = container_manager.get_container_port(created_container.id,challenge.server)
+        # Hand out a pre-started container from the warm pool if one is idle
+        warm_container = None
+        if challenge.warm_pool_size:
+            warm_container = container_manager.claim_warm_container(challenge)
 
-        # Port may be blank if the container failed to start
-        if port is None:
-            return json.dumps({
-                "status": "error",
-                "error": "Could not get port"
-            })
+        if warm_container is not None:
+            container_id = warm_container["container_id"]
+            port = warm_container["port"]
+            server = warm_container["server"]
+        else:
+            # Run a new Docker container
+            try:
+                created_container = container_manager.create_container(
+                    chal_id, xid, uid, challenge.image, challenge.port, challenge.command, challenge.volumes,challenge.server,
+                    resources=container_manager.get_resource_profile(challenge))
+            except CapacityException as err:
+                # Fail fast so the player retries later instead of holding a worker while servers are full
+                return {"error": str(err), "retry_after": err.retry_after}, 503
+            except ContainerException as err:
+                return {"error": str(err)}
+            container_id = created_container.id
+            port = created_container.port
+            server = created_container.server
 
         expires = int(time.time() + container_manager.expiration_seconds)
 
         # Insert the new container into the database
         if is_team is True:
             new_container = ContainerInfoModel(
-                container_id=created_container.id,
+                container_id=container_id,
                 challenge_id=challenge.id,
                 team_id=xid,
                 user_id=uid,
                 port=port,
                 timestamp=int(time.time()),
                 expires=expires,
-                server=challenge.server
+                server=server
             )
         else: 
             new_container = ContainerInfoModel(
-                container_id=created_container.id,
+                container_id=container_id,
                 challenge_id=challenge.id,
                 user_id=xid,
                 port=port,
                 timestamp=int(time.time()),
                 expires=expires,
-                server=challenge.server
+                server=server
             )
         db.session.add(new_container)
+        # The full row goes along, so open dashboards can show it without asking for it
+        row = query_running_containers().filter(ContainerInfoModel.container_id == container_id).first()
+        container_manager.feed.record(
+            "created", [container_id], container=serialize_running_container(row, is_team is True, True))
         db.session.commit()
+        container_manager.schedule_expiry(expires)
+        if warm_container is not None:
+            container_manager.request_pool_refill()
 
         return json.dumps({
             "status": "created",
-            "hostname": hostname,
+            "hostname": container_manager.get_server_hostname(server),
             "port": port,
             "connect": challenge.ctype,
             "expires": expires
         })
 
-    def view_container_info(chal_id, xid, is_team):
-        # Get the requested challenge
-        challenge = ContainerChallenge.challenge_model.query.filter_by(
-            id=chal_id).first()
-
-        # Make sure the challenge exists and is a container challenge
+    def to_response_body(result):
+        # Normalise what the helpers above return (JSON string, dict or (dict, code) tuple) into a JSON string and code
+        code = 200
+        if isinstance(result, tuple):
+            result, code = result
+        if not isinstance(result, str):
+            result = json.dumps(result)
+        return result, code
+
+    def request_container(chal_id, xid, uid, is_team):
+        # Make sure the challenge exists before queueing any work for it
+        challenge = get_challenge_spec(chal_id)
         if challenge is None:
             return {"error": "Challenge not found"}, 400
 
-        # Check for any existing containers for the team
+        def spawn(job_id):
+            start = time.monotonic()
+            body, code = to_response_body(create_container(chal_id, xid, uid, is_team))
+            if code == 200:
+                status = json.loads(body).get("status", "error")
+            else:
+                status = "capacity" if code == 503 else "error"
+            spawn_requests.inc(status=status)
+            spawn_request_latency.observe(time.monotonic() - start, status=status)
+            return body, code
+
+        # Double clicks and teammates starting the same challenge together all share one spawn
+        coalesce_key = f"{challenge.id}:{'team' if is_team else 'user'}:{xid}"
+        job_id = container_manager.enqueue_job(
+            spawn, challenge_id=challenge.id, team_id=xid if is_team else None, user_id=uid,
+            coalesce_key=coalesce_key)
+        return {"status": "queued", "job_id": job_id}
+
+    def get_owner_container(challenge, xid, is_team) -> "ContainerView|None":
+        if challenge.spawn_mode == SHARED_SPAWN_MODE:
+            leased = container_manager.get_lease(challenge.id, xid, is_team)
+            if leased is None:
+                return None
+            replica, lease = leased
+            return ContainerView(replica.container_id, replica.server, replica.port, lease.expires, True)
+
         if is_team is True:
-            running_containers = ContainerInfoModel.query.filter_by(
-                challenge_id=challenge.id, team_id=xid)
+            container = ContainerInfoModel.query.filter_by(challenge_id=challenge.id, team_id=xid).first()
         else:
-            running_containers = ContainerInfoModel.query.filter_by(
-                challenge_id=challenge.id, user_id=xid)
-        running_container = running_containers.first()
+            container = ContainerInfoModel.query.filter_by(challenge_id=challenge.id, user_id=xid).first()
+        if container is None:
+            return None
+        return ContainerView(container.container_id, container.server, container.port, container.expires, False)
 
+    def view_container_info(challenge, running_container):
         # If a container is already running for the team, return it
         if running_container:
             # Check if Docker says the container is still running before returning it
             try:
                 if container_manager.is_container_running(
-                        running_container.container_id):
+                        running_container.container_id, running_container.server):
                     return json.dumps({
                         "status": "already_running",
-                        "hostname": container_manager.settings.get("docker_hostname", ""),
+                        "hostname": container_manager.get_server_hostname(running_container.server),
                         "port": running_container.port,
                         "connect": challenge.ctype,
                         "expires": running_container.expires
                     })
                 else:
                     # Container is not running, it must have died or been killed,
-                    # remove it from the database and create a new one
-                    running_containers.delete()
+                    # remove it from the database so a new one can be created
+                    if running_container.shared:
+                        # Every team leasing the dead replica moves on to another one
+                        for model in (ContainerReplicaModel, ContainerLeaseModel):
+                            model.query.filter_by(container_id=running_container.container_id).delete()
+                    else:
+                        ContainerInfoModel.query.filter_by(
+                            container_id=running_container.container_id).delete()
+                        container_manager.feed.record("killed", [running_container.container_id])
                     db.session.commit()
             except ContainerException as err:
                 return {"error": str(err)}, 500
-        else:
-            return {"status": "Suffering hasn't begun"}
+        return {"status": "Suffering hasn't begun"}
+
+    def view_info_etag(challenge, xid, is_team, running_container) -> str:
+        if running_container is None:
+            return make_etag(challenge.id, is_team, xid, None)
+        return make_etag(
+            challenge.id, is_team, xid, running_container.container_id, running_container.port,
+            running_container.expires, container_manager.get_server_hostname(running_container.server),
+            challenge.ctype)
 
     def connect_type(chal_id):
         # Get the requested challenge
-        challenge = ContainerChallenge.challenge_model.query.filter_by(
-            id=chal_id).first()
+        challenge = get_challenge_spec(chal_id)
 
         # Make sure the challenge exists and is a container challenge
         if challenge is None:
@@ -377,16 +692,73 @@ def load(app: Flask):
                         "connect": challenge.ctype
                     })
 
+    def conditional_response(result, etag):
+        """JSON response the browser revalidates with If-None-Match before every reuse."""
+        body, code = to_response_body(result)
+        response = Response(body, code, mimetype="application/json")
+        if code == 200:
+            response.set_etag(etag)
+            response.headers["Cache-Control"] = "private, no-cache"
+        return response
+
+    def not_modified(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        response.headers["Cache-Control"] = "private, no-cache"
+        return response
+
     @containers_bp.route('/api/get_connect_type/<int:challenge_id>', methods=['GET'])
     @authed_only
     @during_ctf_time_only
     @require_verified_emails
     @ratelimit(method="GET", limit=settings["requests"]["limit"], interval=settings["requests"]["limit"])
     def get_connect_type(challenge_id):
+        challenge = get_challenge_spec(challenge_id)
+        etag = make_etag(challenge_id, challenge.ctype if challenge is not None else None)
+        if request.if_none_match.contains(etag):
+            return not_modified(etag)
+        try:
+            return conditional_response(connect_type(challenge_id), etag)
+        except ContainerException as err:
+            return {"error": str(err)}, 500
+
+    @containers_bp.route('/api/view_info/<int:challenge_id>', methods=['GET'])
+    @authed_only
+    @during_ctf_time_only
+    @require_verified_emails
+    @ratelimit(method="GET", limit=settings["requests"]["limit"], interval=settings["requests"]["limit"])
+    def route_get_view_info(challenge_id):
+        """
+        Conditional variant of view_info. Rows of containers that die are removed by the Docker events
+        listener, so while the owning server's stream is live an unchanged row means an unchanged answer,
+        and a matching If-None-Match gets a 304 without asking Docker.
+        """
+        user = get_current_user()
+        if user is None:
+            return {"error": "User not found"}, 400
+        is_team = is_team_mode() is True
+        if is_team and user.team is None:
+            return {"error": "User not a member of a team"}, 400
+        xid = user.team.id if is_team else user.id
+
+        challenge = get_challenge_spec(challenge_id)
+        if challenge is None:
+            return {"error": "Challenge not found"}, 400
+
+        running_container = get_owner_container(challenge, xid, is_team)
+        etag = view_info_etag(challenge, xid, is_team, running_container)
+        if request.if_none_match.contains(etag) and (
+                running_container is None or container_manager.is_state_current(running_container.server)):
+            return not_modified(etag)
+
         try:
-            return connect_type(challenge_id)
+            result = view_container_info(challenge, running_container)
         except ContainerException as err:
             return {"error": str(err)}, 500
+        if running_container is not None and isinstance(result, dict):
+            # The row was just dropped, tag the answer with the state the next request will find
+            etag = view_info_etag(challenge, xid, is_team, None)
+        return conditional_response(result, etag)
 
     @containers_bp.route('/api/view_info', methods=['POST'])
     @authed_only
@@ -408,11 +780,15 @@ def load(app: Flask):
         if user.team is None and is_team_mode() is True:
             return {"error": "User not a member of a team"}, 400
 
+        challenge = get_challenge_spec(request.json.get("chal_id"))
+        if challenge is None:
+            return {"error": "Challenge not found"}, 400
+
         try:
             if is_team_mode() is True:
-                return view_container_info(request.json.get("chal_id"), user.team.id, True)
+                return view_container_info(challenge, get_owner_container(challenge, user.team.id, True))
             elif is_team_mode() is False:
-                return view_container_info(request.json.get("chal_id"), user.id, False)
+                return view_container_info(challenge, get_owner_container(challenge, user.id, False))
         except ContainerException as err:
             return {"error": str(err)}, 500
 
@@ -436,14 +812,44 @@ def load(app: Flask):
         if user.team is None and is_team_mode() is True:
             return {"error": "User not a member of a team"}, 400
 
+        # The container is started by a background job, clients poll /api/request/<job_id> for the result
         try:
             if is_team_mode() is True:
-                return create_container(request.json.get("chal_id"), user.team.id, user.id,True)
+                return request_container(request.json.get("chal_id"), user.team.id, user.id,True)
             elif is_team_mode() is False:
-                return create_container(request.json.get("chal_id"), user.id, user.id, False)   
+                return request_container(request.json.get("chal_id"), user.id, user.id, False)   
         except ContainerException as err:
             return {"error": str(err)}, 500
 
+    @containers_bp.route('/api/request/<job_id>', methods=['GET'])
+    @authed_only
+    @during_ctf_time_only
+    @require_verified_emails
+    @ratelimit(method="GET", limit=settings["requests"]["limit"], interval=settings["requests"]["limit"])
+    def route_request_status(job_id):
+        user = get_current_user()
+
+        if user is None:
+            return {"error": "User not found"}, 400
+
+        job = container_manager.get_job(job_id)
+
+        # Only the team (or user) that requested the container may see its connection info
+        if job is None or job.kind != "spawn":
+            return {"error": "Request not found"}, 404
+        if is_team_mode() is True and (user.team is None or job.team_id != user.team.id):
+            return {"error": "Request not found"}, 404
+        if is_team_mode() is False and job.user_id != user.id:
+            return {"error": "Request not found"}, 404
+
+        if job.status != "finished":
+            return {"status": job.status, "job_id": job.id}
+
+        response = app.response_class(job.result, status=job.result_code, mimetype="application/json")
+        if job.result_code == 503:
+            response.headers["Retry-After"] = str(json.loads(job.result).get("retry_after", ""))
+        return response
+
     @containers_bp.route('/api/renew', methods=['POST'])
     @authed_only
     @during_ctf_time_only
@@ -503,6 +909,18 @@ def load(app: Flask):
 
             return create_container(request.json.get("chal_id"), user.id, None, False)
 
+    def release_lease(challenge, user):
+        if is_team_mode() is True:
+            released = ContainerLeaseModel.query.filter_by(challenge_id=challenge.id, team_id=user.team.id).delete()
+        else:
+            released = ContainerLeaseModel.query.filter_by(challenge_id=challenge.id, user_id=user.id).delete()
+        db.session.commit()
+        if not released:
+            return {"error": "No container found"}, 400
+        # The replica keeps running for the other teams, it is scaled down once it is no longer needed
+        container_manager.request_replica_scaling()
+        return {"success": "Container killed"}
+
     @containers_bp.route('/api/stop', methods=['POST'])
     @authed_only
     @during_ctf_time_only
@@ -523,6 +941,10 @@ def load(app: Flask):
         if user.team is None and is_team_mode() is True:
             return {"error": "User not a member of a team"}, 400
 
+        challenge = get_challenge_spec(request.json.get("chal_id"))
+        if challenge is not None and challenge.spawn_mode == SHARED_SPAWN_MODE:
+            return release_lease(challenge, user)
+
         if is_team_mode() is True:
             running_container: ContainerInfoModel = ContainerInfoModel.query.filter_by(
                 challenge_id=request.json.get("chal_id"), team_id=user.team.id).first()
@@ -555,23 +977,48 @@ def load(app: Flask):
     @containers_bp.route('/api/purge', methods=['POST'])
     @admins_only
     def route_purge_containers():
-        containers: "list[ContainerInfoModel]" = ContainerInfoModel.query.all()
-        for container in containers:
-            try:
-                kill_container(container.container_id)
-            except ContainerException:
-                pass
-        return {"success": "Purged all containers"}, 200
+        containers = {container.container_id: container.server for model in (ContainerInfoModel, ContainerReplicaModel)
+            for container in db.session.query(model.container_id, model.server)}
+        try:
+            results = container_manager.kill_containers(containers)
+        except ContainerException:
+            return {"error": "Docker is not initialized. Please check your settings."}, 500
+
+        failed = [container_id for container_id, result in results.items() if "error" in result]
+        if failed:
+            return {"error": f"Could not kill {len(failed)} of {len(results)} containers", "results": results}, 500
+        return {"success": "Purged all containers", "results": results}, 200
 
     @containers_bp.route('/api/images', methods=['GET'])
     @admins_only
     def route_get_images():
         try:
             images = container_manager.get_images()
+            image_servers = container_manager.get_image_servers()
         except ContainerException as err:
             return {"error": str(err)}
 
-        return {"images": images}
+        return {"images": images, "servers": image_servers}
+
+    @containers_bp.route('/api/warmup', methods=['POST'])
+    @admins_only
+    def route_warm_up_images():
+        if not container_manager.client:
+            return {"error": "Docker is not connected"}, 500
+        return {"status": "queued", "job_id": warm_up_images()}
+
+    @containers_bp.route('/api/warmup/<job_id>', methods=['GET'])
+    @admins_only
+    def route_warm_up_status(job_id):
+        job = container_manager.get_job(job_id)
+        if job is None or job.kind != "warmup":
+            return {"error": "Warmup not found"}, 404
+
+        progress = json.loads(job.result) if job.result else {}
+        progress["job_id"] = job.id
+        if job.status != "finished" or "status" not in progress:
+            progress["status"] = job.status
+        return progress
 
     @containers_bp.route('/api/settings/update', methods=['POST'])
     @admins_only
@@ -585,6 +1032,13 @@ def load(app: Flask):
             "container_maxcpu",
         ]
 
+        optional_fields = [
+            "docker_pool_size",
+            "container_port_range",
+            "warmup_on_load",
+            "docker_server_limits",
+        ]
+
         # Validate required fields
         for field in required_fields:
             if request.form.get(field) is None:
@@ -599,9 +1053,25 @@ def load(app: Flask):
         except Exception as e:
             return {"error": f"Invalid docker_servers JSON: {str(e)}"}, 400
 
+        port_range = request.form.get("container_port_range")
+        if port_range:
+            try:
+                start, end = [int(port) for port in port_range.split("-")]
+                if not 1 <= start <= end <= 65535:
+                    raise ValueError("ports must be between 1 and 65535")
+            except ValueError as e:
+                return {"error": f"Invalid container_port_range, expected e.g. 30000-40000: {str(e)}"}, 400
+
+        try:
+            ContainerManager.parse_server_limits(request.form.get("docker_server_limits"))
+        except ContainerException as e:
+            return {"error": f"Invalid docker_server_limits: {str(e)}"}, 400
+
         # Save docker_servers as a JSON string
-        for key in required_fields:
+        for key in required_fields + optional_fields:
             value = request.form.get(key)
+            if value is None:
+                continue
             if key == "docker_servers":
                 value = json.dumps(docker_servers)
 
@@ -614,43 +1084,92 @@ def load(app: Flask):
 
         db.session.commit()
 
-        # Refresh container manager settings
+        # Refresh container manager settings, which also rebuilds its server map
+        plugin_cache.invalidate()
         container_manager.settings = settings_to_dict(ContainerSettingsModel.query.all())
 
         try:
-            container_manager.initialize_connection(container_manager.settings, Flask)
+            container_manager.initialize_connection(container_manager.settings, app)
         except ContainerException as err:
             flash(str(err), "error")
             return redirect(url_for(".route_containers_settings"))
 
         return redirect(url_for(".route_containers_dashboard"))
 
+    @containers_bp.route('/api/metrics', methods=['GET'])
+    @admins_only
+    def route_get_metrics():
+        return app.response_class(
+            container_manager.render_metrics(), mimetype="text/plain; version=0.0.4")
+
     @containers_bp.route('/dashboard', methods=['GET'])
     @admins_only
     def route_containers_dashboard():
-        running_containers = ContainerInfoModel.query.order_by(
-            ContainerInfoModel.timestamp.desc()).all()
-
         connected = False
         try:
             connected = container_manager.is_connected()
         except ContainerException:
             pass
 
-        for i, container in enumerate(running_containers):
-            try:
-                running_containers[i].is_running = container_manager.is_container_running(
-                    container.container_id)
-            except ContainerException:
-                running_containers[i].is_running = False
+        try:
+            capacity = container_manager.get_capacity_overview()
+        except ContainerException:
+            capacity = {"servers": {}, "queued": 0}
 
-        return render_template('container_dashboard.html', containers=running_containers, connected=connected)
+        # The container table is paged in by the browser from /api/running_containers
+        return render_template('container_dashboard.html', connected=connected, capacity=capacity,
+                               team_mode=is_team_mode() is True, per_page=RUNNING_CONTAINERS_PER_PAGE)
 
     @containers_bp.route('/api/running_containers', methods=['GET'])
     @admins_only
     def route_get_running_containers():
-        running_containers = ContainerInfoModel.query.order_by(
-            ContainerInfoModel.timestamp.desc()).all()
+        """
+        One page of running containers, filtered and sorted in the database.
+
+        Query parameters: page, per_page, challenge_id, team_id, user_id, server,
+        sort (one of RUNNING_CONTAINERS_SORTS) and order (asc or desc).
+        """
+        page = max(request.args.get("page", 1, type=int), 1)
+        per_page = min(max(request.args.get("per_page", RUNNING_CONTAINERS_PER_PAGE, type=int), 1),
+                       RUNNING_CONTAINERS_MAX_PER_PAGE)
+        sort = request.args.get("sort", "created")
+        if sort not in RUNNING_CONTAINERS_SORTS:
+            return {"error": f"Invalid sort, use one of {', '.join(RUNNING_CONTAINERS_SORTS)}"}, 400
+        order = request.args.get("order", "desc")
+        if order not in ("asc", "desc"):
+            return {"error": "Invalid order, use asc or desc"}, 400
+
+        team_mode = is_team_mode() is True
+        filters = []
+        challenge_id = request.args.get("challenge_id", type=int)
+        if challenge_id is not None:
+            filters.append(ContainerInfoModel.challenge_id == challenge_id)
+        team_id = request.args.get("team_id", type=int)
+        if team_id is not None:
+            filters.append(ContainerInfoModel.team_id == team_id)
+        user_id = request.args.get("user_id", type=int)
+        if user_id is not None:
+            filters.append(ContainerInfoModel.user_id == user_id)
+        server = request.args.get("server")
+        if server:
+            filters.append(ContainerInfoModel.server == server)
+
+        query = query_running_containers().filter(*filters)
+
+        total = db.session.query(db.func.count(ContainerInfoModel.container_id)).filter(*filters).scalar()
+
+        sort_columns = {
+            "challenge": ContainerChallengeModel.name,
+            "team": Teams.name if team_mode else Users.name,
+            "server": ContainerInfoModel.server,
+            "expires": ContainerInfoModel.expires,
+            "created": ContainerInfoModel.timestamp,
+        }
+        sort_column = sort_columns[sort]
+        # The primary key breaks ties, so rows do not move between pages
+        query = query.order_by(sort_column.asc() if order == "asc" else sort_column.desc(),
+                               ContainerInfoModel.container_id)
+        rows = query.offset((page - 1) * per_page).limit(per_page).all()
 
         connected = False
         try:
@@ -658,67 +1177,61 @@ def load(app: Flask):
         except ContainerException:
             pass
 
-        # Create lists to store unique teams and challenges
-        unique_teams = set()
-        unique_challenges = set()
-
-        for i, container in enumerate(running_containers):
-            try:
-                running_containers[i].is_running = container_manager.is_container_running(
-                    container.container_id)
-            except ContainerException:
-                running_containers[i].is_running = False
-
-            # Add team and challenge to the unique sets
-            if is_team_mode() is True:
-                unique_teams.add(f"{container.team.name} [{container.team_id}]")
-            else:   
-                unique_teams.add(f"{container.user.name} [{container.user_id}]")
-            unique_challenges.add(f"{container.challenge.name} [{container.challenge_id}]")
-
-        # Convert unique sets to lists
-        unique_teams_list = list(unique_teams)
-        unique_challenges_list = list(unique_challenges)
-
-        # Create a list of dictionaries containing running_containers data
-        running_containers_data = []
-        for container in running_containers:
-            if is_team_mode() is True:
-                container_data = {
-                    "container_id": container.container_id,
-                    "image": container.challenge.image,
-                    "challenge": f"{container.challenge.name} [{container.challenge_id}]",
-                    "team": f"{container.team.name} [{container.team_id}]",
-                    "user": f"{container.user.name} [{container.user_id}]",
-                    "port": container.port,
-                    "created": container.timestamp,
-                    "expires": container.expires,
-                    "is_running": container.is_running
-                }
-            else:
-                container_data = {
-                    "container_id": container.container_id,
-                    "image": container.challenge.image,
-                    "challenge": f"{container.challenge.name} [{container.challenge_id}]",
-                    "user": f"{container.user.name} [{container.user_id}]",
-                    "port": container.port,
-                    "created": container.timestamp,
-                    "expires": container.expires,
-                    "is_running": container.is_running
-                }
-            running_containers_data.append(container_data)
-
-        # Create a JSON response containing running_containers_data, unique teams, and unique challenges
-        response_data = {
-            "containers": running_containers_data,
+        try:
+            statuses = container_manager.get_containers_status()
+        except ContainerException:
+            statuses = {}
+
+        containers = [serialize_running_container(row, team_mode, statuses.get(row[0]) == "running") for row in rows]
+
+        # Filter choices come from the whole table, not just this page
+        challenges = db.session.query(ContainerInfoModel.challenge_id, ContainerChallengeModel.name) \
+            .join(ContainerChallengeModel, ContainerChallengeModel.id == ContainerInfoModel.challenge_id) \
+            .distinct().order_by(ContainerChallengeModel.name).all()
+        if team_mode:
+            owners = db.session.query(ContainerInfoModel.team_id, Teams.name) \
+                .join(Teams, Teams.id == ContainerInfoModel.team_id) \
+                .distinct().order_by(Teams.name).all()
+        else:
+            owners = db.session.query(ContainerInfoModel.user_id, Users.name) \
+                .join(Users, Users.id == ContainerInfoModel.user_id) \
+                .distinct().order_by(Users.name).all()
+        servers = db.session.query(ContainerInfoModel.server).distinct().order_by(ContainerInfoModel.server).all()
+
+        return {
+            "containers": containers,
+            "page": page,
+            "per_page": per_page,
+            "total": total,
             "connected": connected,
-            "teams": unique_teams_list,
-            "challenges": unique_challenges_list
+            "team_mode": team_mode,
+            "challenges": [list(challenge) for challenge in challenges],
+            "owners": [list(owner) for owner in owners],
+            "servers": [server for (server,) in servers],
         }
-
-        # Return the JSON response
-        return json.dumps(response_data)
   
+    @containers_bp.route('/api/running_containers/stream', methods=['GET'])
+    @admins_only
+    def route_stream_running_containers():
+        """
+        Server-Sent Events stream of container changes for the dashboard: created, renewed, killed, expired and
+        status events, plus reset when the dashboard should fetch its page again. Each connection holds a
+        worker thread, so run CTFd with threaded or gevent workers when admins keep the dashboard open.
+        """
+        def stream():
+            yield "retry: 5000\n\n"
+            for event in container_manager.feed.subscribe(STREAM_KEEPALIVE):
+                if event is None:
+                    yield ": keep-alive\n\n"
+                else:
+                    yield f"data: {json.dumps(event)}\n\n"
+
+        return Response(stream(), mimetype="text/event-stream", headers={
+            "Cache-Control": "no-cache",
+            # Stop nginx from buffering the stream
+            "X-Accel-Buffering": "no",
+        })
+
     @containers_bp.route('/api/running_servers', methods=['GET'])
     @admins_only
     def route_get_running_servers():
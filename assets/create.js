@@ -31,6 +31,10 @@ fetch(path, {
             var opt = document.createElement("option");
             opt.value = data.images[i];
             opt.innerHTML = data.images[i];
+            if (data.servers !== undefined && data.servers[data.images[i]] !== undefined) {
+                // Show which Docker servers already have the image
+                opt.innerHTML += " (" + data.servers[data.images[i]].join(", ") + ")";
+            }
             containerImage.appendChild(opt);
         }
         containerImageDefault.innerHTML = "Choose an image...";
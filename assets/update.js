@@ -20,6 +20,10 @@ fetch(path, {
                 var opt = document.createElement("option");
                 opt.value = data.images[i];
                 opt.innerHTML = data.images[i];
+                if (data.servers !== undefined && data.servers[data.images[i]] !== undefined) {
+                    // Show which Docker servers already have the image
+                    opt.innerHTML += " (" + data.servers[data.images[i]].join(", ") + ")";
+                }
                 containerImage.appendChild(opt);
             }
             containerImageDefault.innerHTML = "Choose an image...";
@@ -100,6 +104,9 @@ fetch(server_path, {
         }
         containerServerDefault.innerHTML = "Choose a server...";
         containerServer.removeAttribute("disabled");
+        if (container_server_selected) {
+            containerServer.value = container_server_selected;
+        }
     }
     console.log(data);
 })
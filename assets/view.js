@@ -111,17 +111,17 @@ function createChallengeLinkElement(data, parent) {
 
 function view_container_info(challenge_id) {
     resetAlert();
-    var path = "/containers/api/view_info";
+    var path = "/containers/api/view_info/" + challenge_id;
     
     let alert = document.getElementById("deployment-info");
+    // Revalidated with If-None-Match, an unchanged container comes back as a 304 from the browser cache
     fetch(path, {
-        method: "POST",
+        method: "GET",
+        cache: "no-cache",
         headers: {
-            "Content-Type": "application/json",
             "Accept": "application/json",
             "CSRF-Token": init.csrfNonce
-        },
-        body: JSON.stringify({ chal_id: challenge_id })
+        }
     })
     .then(response => response.json())
     .then(data => {
@@ -159,21 +159,45 @@ function container_request(challenge_id) {
     })
     .then(response => response.json())
     .then(data => {
-        if (data.error !== undefined) {
-            // Container error
+        if (data.job_id !== undefined) {
+            // The container is being started in the background
+            alert.append("Starting your container...");
+            setTimeout(() => container_request_poll(data.job_id, challenge_id), CONTAINER_REQUEST_POLL_MIN);
+        } else {
+            container_request_done(data);
+        }
+    })
+    .catch(error => {
+        console.error("Fetch error:", error);
+    });
+}
+
+// Milliseconds between polls of a queued container request, doubling up to the maximum while it starts
+var CONTAINER_REQUEST_POLL_MIN = 250;
+var CONTAINER_REQUEST_POLL_MAX = 4000;
+
+function container_request_poll(job_id, challenge_id, delay = CONTAINER_REQUEST_POLL_MIN) {
+    var path = "/containers/api/request/" + job_id;
+
+    fetch(path, {
+        method: "GET",
+        headers: {
+            "Accept": "application/json",
+            "CSRF-Token": init.csrfNonce
+        }
+    })
+    .then(response => response.json())
+    .then(data => {
+        if (data.status == "queued" || data.status == "running") {
+            let next = Math.min(delay * 2, CONTAINER_REQUEST_POLL_MAX);
+            setTimeout(() => container_request_poll(job_id, challenge_id, next), delay);
+        } else if (data.retry_after !== undefined) {
+            // Every server is full or the shared instance is starting, ask again once it is expected to be ready
+            let alert = resetAlert();
             alert.append(data.error);
-            alert.classList.toggle('alert-danger');
-            toggleChallengeCreate();
-        } else if (data.message !== undefined) {
-            // CTFd error
-            alert.append(data.message);
-            alert.classList.toggle('alert-danger');
-            toggleChallengeCreate();
+            setTimeout(() => container_request(challenge_id), data.retry_after * 1000);
         } else {
-            // Success
-            createChallengeLinkElement(data, alert);
-            toggleChallengeUpdate();
-            toggleChallengeCreate();
+            container_request_done(data);
         }
     })
     .catch(error => {
@@ -181,6 +205,27 @@ function container_request(challenge_id) {
     });
 }
 
+function container_request_done(data) {
+    let alert = resetAlert();
+
+    if (data.error !== undefined) {
+        // Container error
+        alert.append(data.error);
+        alert.classList.toggle('alert-danger');
+        toggleChallengeCreate();
+    } else if (data.message !== undefined) {
+        // CTFd error
+        alert.append(data.message);
+        alert.classList.toggle('alert-danger');
+        toggleChallengeCreate();
+    } else {
+        // Success
+        createChallengeLinkElement(data, alert);
+        toggleChallengeUpdate();
+        toggleChallengeCreate();
+    }
+}
+
 function container_renew(challenge_id) {
     var path = "/containers/api/renew";
     let alert = resetAlert();
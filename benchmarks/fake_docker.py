@@ -0,0 +1,189 @@
+import queue
+import threading
+import time
+import uuid
+
+import docker
+
+# Shared state of every fake daemon, keyed by base URL, so clients recreated on reconnect see the same containers
+DAEMONS = {}
+DAEMONS_LOCK = threading.Lock()
+
+
+class FakeDaemon:
+    """In-memory Docker daemon with a fixed latency per API call, and a separate one for starting containers."""
+    def __init__(self, base_url: str, latency: float, run_latency: float, images: "set[str]"):
+        self.base_url = base_url
+        self.latency = latency
+        self.run_latency = run_latency
+        self.images = set(images)
+        self.lock = threading.Lock()
+        self.containers = {}
+        self.subscribers = []
+
+    def call(self, latency: float = None) -> None:
+        time.sleep(self.latency if latency is None else latency)
+
+    def emit(self, action: str, container: "FakeContainer") -> None:
+        event = {"Type": "container", "Action": action, "status": action, "id": container.id,
+                 "Actor": {"ID": container.id, "Attributes": dict(container.labels)}}
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for subscriber in subscribers:
+            subscriber.put(event)
+
+
+def get_daemon(base_url: str, latency: float = 0.0, run_latency: float = 0.0, images: "set[str]" = ()) -> FakeDaemon:
+    with DAEMONS_LOCK:
+        if base_url not in DAEMONS:
+            DAEMONS[base_url] = FakeDaemon(base_url, latency, run_latency, images)
+        return DAEMONS[base_url]
+
+
+class FakeContainer:
+    def __init__(self, daemon: FakeDaemon, image: str, ports: dict, labels: dict):
+        self.daemon = daemon
+        self.id = uuid.uuid4().hex + uuid.uuid4().hex
+        self.image = image
+        self.labels = labels or {}
+        self.status = "running"
+        self.host_ports = {
+            f"{private}/tcp": [{"HostIp": "0.0.0.0", "HostPort": str(public)}] for private, public in (ports or {}).items()}
+
+    @property
+    def attrs(self) -> dict:
+        return {
+            "Id": self.id,
+            "State": self.status,
+            "Labels": self.labels,
+            "Ports": [{"PrivatePort": int(private.split("/")[0]), "PublicPort": int(mapping[0]["HostPort"]), "Type": "tcp"}
+                      for private, mapping in self.host_ports.items()],
+        }
+
+    @property
+    def ports(self) -> dict:
+        return self.host_ports
+
+    def reload(self) -> None:
+        self.daemon.call()
+
+    def kill(self) -> None:
+        self.daemon.call()
+        with self.daemon.lock:
+            if self.daemon.containers.pop(self.id, None) is None:
+                raise docker.errors.NotFound("No such container")
+        # Started with auto_remove, so the container is destroyed right after it dies
+        self.daemon.emit("die", self)
+        self.daemon.emit("destroy", self)
+
+
+class FakeContainers:
+    def __init__(self, daemon: FakeDaemon):
+        self.daemon = daemon
+
+    def run(self, image: str, ports: dict = None, labels: dict = None, **kwargs) -> FakeContainer:
+        self.daemon.call(self.daemon.run_latency)
+        if image not in self.daemon.images:
+            raise docker.errors.ImageNotFound(f"No such image: {image}")
+        with self.daemon.lock:
+            public_ports = {str(port) for port in (ports or {}).values()}
+            for container in self.daemon.containers.values():
+                for mapping in container.host_ports.values():
+                    if mapping[0]["HostPort"] in public_ports:
+                        raise docker.errors.APIError("Bind for 0.0.0.0 failed: port is already allocated")
+            container = FakeContainer(self.daemon, image, ports, labels)
+            self.daemon.containers[container.id] = container
+        self.daemon.emit("start", container)
+        return container
+
+    def get(self, container_id: str) -> FakeContainer:
+        self.daemon.call()
+        with self.daemon.lock:
+            for container in self.daemon.containers.values():
+                if container.id.startswith(container_id):
+                    return container
+        raise docker.errors.NotFound("No such container")
+
+    def list(self, all: bool = False, sparse: bool = False, filters: dict = None, **kwargs) -> "list[FakeContainer]":
+        self.daemon.call()
+        filters = filters or {}
+        with self.daemon.lock:
+            containers = list(self.daemon.containers.values())
+        if "id" in filters:
+            containers = [container for container in containers if container.id.startswith(filters["id"])]
+        if "label" in filters:
+            labels = filters["label"] if isinstance(filters["label"], list) else [filters["label"]]
+            for label in labels:
+                key, _, value = label.partition("=")
+                containers = [container for container in containers
+                              if key in container.labels and (not value or container.labels[key] == value)]
+        return containers
+
+
+class FakeImage:
+    def __init__(self, tag: str):
+        self.tags = [tag]
+
+
+class FakeImages:
+    def __init__(self, daemon: FakeDaemon):
+        self.daemon = daemon
+
+    def list(self, **kwargs) -> "list[FakeImage]":
+        self.daemon.call()
+        return [FakeImage(tag) for tag in sorted(self.daemon.images)]
+
+    def get(self, name: str) -> FakeImage:
+        self.daemon.call()
+        if name not in self.daemon.images:
+            raise docker.errors.ImageNotFound(f"No such image: {name}")
+        return FakeImage(name)
+
+    def pull(self, repository: str, tag: str = None, **kwargs) -> FakeImage:
+        self.daemon.call(self.daemon.run_latency)
+        name = f"{repository}:{tag or 'latest'}"
+        self.daemon.images.add(name)
+        return FakeImage(name)
+
+
+class FakeEventStream:
+    def __init__(self, daemon: FakeDaemon):
+        self.daemon = daemon
+        self.events = queue.Queue()
+        with daemon.lock:
+            daemon.subscribers.append(self.events)
+
+    def __iter__(self):
+        while True:
+            event = self.events.get()
+            if event is None:
+                return
+            yield event
+
+    def close(self) -> None:
+        with self.daemon.lock:
+            if self.events in self.daemon.subscribers:
+                self.daemon.subscribers.remove(self.events)
+        self.events.put(None)
+
+
+class FakeDockerClient:
+    """Drop-in for docker.DockerClient covering the calls the plugin makes."""
+    def __init__(self, base_url: str = None, **kwargs):
+        self.daemon = get_daemon(base_url)
+        self.containers = FakeContainers(self.daemon)
+        self.images = FakeImages(self.daemon)
+
+    def ping(self) -> bool:
+        self.daemon.call()
+        return True
+
+    def info(self) -> dict:
+        self.daemon.call()
+        return {"MemTotal": 64 * 1024 ** 3, "NCPU": 32}
+
+    def events(self, decode: bool = False, filters: dict = None, **kwargs) -> FakeEventStream:
+        return FakeEventStream(self.daemon)
+
+    def close(self) -> None:
+        pass
@@ -0,0 +1,253 @@
+"""
+Load test of the containers plugin. A real CTFd app backed by SQLite serves the plugin routes, while Docker is
+replaced by in-memory fake daemons with configurable latency. N teams of M players each start one of M
+challenges at the same time, then use, renew and stop their containers; whatever is left is expired and
+reaped. Reports p50, p99 and throughput per route and for the reaper.
+
+Run it from the CTFd checkout the plugin is installed in, e.g.
+
+    python -m CTFd.plugins.containers.benchmarks.run --teams 50 --challenges 4 --json results.json
+"""
+import argparse
+import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import docker
+
+from . import fake_docker
+
+BENCHMARK_IMAGE = "benchmark:latest"
+PASSWORD = "password"
+# Seconds between polls of a queued container request, like the challenge view does
+POLL_INTERVAL = 0.05
+POLL_TIMEOUT = 120
+
+
+def percentile(values: "list[float]", fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+class Recorder:
+    """Latencies and failures per route, plus the wall time of the phase each route ran in."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = {}
+        self.errors = {}
+        self.walltimes = {}
+
+    def record(self, route: str, seconds: float, ok: bool) -> None:
+        with self.lock:
+            self.latencies.setdefault(route, []).append(seconds)
+            if not ok:
+                self.errors[route] = self.errors.get(route, 0) + 1
+
+    def timed(self, route: str, func):
+        start = time.perf_counter()
+        response = func()
+        self.record(route, time.perf_counter() - start, response.status_code < 400)
+        return response
+
+    def phase(self, routes: "list[str]", seconds: float) -> None:
+        for route in routes:
+            self.walltimes[route] = self.walltimes.get(route, 0) + seconds
+
+    def summary(self) -> dict:
+        results = {}
+        for route, latencies in self.latencies.items():
+            walltime = self.walltimes.get(route) or sum(latencies)
+            results[route] = {
+                "count": len(latencies),
+                "errors": self.errors.get(route, 0),
+                "p50_ms": round(percentile(latencies, 0.5) * 1000, 2),
+                "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+                "throughput_per_s": round(len(latencies) / walltime, 2) if walltime else 0.0,
+            }
+        return results
+
+
+def create_benchmark_app(db_path: str):
+    from CTFd import create_app
+    from CTFd.config import TestingConfig
+
+    class BenchmarkConfig(TestingConfig):
+        SQLALCHEMY_DATABASE_URI = f"sqlite:///{db_path}"
+        SQLALCHEMY_ENGINE_OPTIONS = {"connect_args": {"timeout": 30, "check_same_thread": False}}
+
+    return create_app(BenchmarkConfig)
+
+
+def populate(app, teams: int, challenges: int) -> None:
+    from CTFd.models import db, Admins, Teams, Users
+    from CTFd.utils import set_config
+    from ..models import ContainerChallengeModel
+
+    with app.app_context():
+        set_config("setup", True)
+        set_config("user_mode", "teams")
+        db.session.add(Admins(name="admin", email="admin@benchmark.local", password=PASSWORD, verified=True))
+        for challenge in range(challenges):
+            db.session.add(ContainerChallengeModel(
+                name=f"benchmark-{challenge}", category="benchmark", description="", state="visible",
+                type="container", initial=100, minimum=10, decay=10, image=BENCHMARK_IMAGE, port=80,
+                ctype="tcp", server="*", command="", volumes=""))
+        for team_index in range(teams):
+            team = Teams(name=f"team-{team_index}", email=f"team-{team_index}@benchmark.local", password=PASSWORD)
+            db.session.add(team)
+            db.session.flush()
+            # One player per challenge, so every player stays well under MAX_CONTAINERS_ALLOWED
+            for member in range(challenges):
+                db.session.add(Users(
+                    name=f"player-{team_index}-{member}", email=f"player-{team_index}-{member}@benchmark.local",
+                    password=PASSWORD, verified=True, team_id=team.id))
+        db.session.commit()
+
+
+def login(app, name: str, address: str):
+    """Log in through the CTFd form and return the client with its CSRF nonce."""
+    client = app.test_client()
+    # Rate limits are per address, give every player their own like in a real event
+    client.environ_base["REMOTE_ADDR"] = address
+    client.get("/login")
+    with client.session_transaction() as session:
+        nonce = session.get("nonce")
+    client.post("/login", data={"name": name, "password": PASSWORD, "nonce": nonce})
+    with client.session_transaction() as session:
+        nonce = session.get("nonce")
+    return client, {"CSRF-Token": nonce}
+
+
+def configure_servers(admin, headers: dict, servers: int) -> None:
+    response = admin.post("/containers/api/settings/update", headers=headers, data={
+        "docker_servers": json.dumps({f"bench-{index}": f"unix:///benchmark/{index}.sock" for index in range(servers)}),
+        "docker_hostname": "localhost",
+        "container_expiration": "45",
+        "container_maxmemory": "256",
+        "container_maxcpu": "0.5",
+        "docker_pool_size": "32",
+        "nonce": headers["CSRF-Token"],
+    })
+    if response.status_code >= 400:
+        raise SystemExit(f"Could not configure the Docker servers: {response.data!r}")
+
+
+def run_phase(recorder: Recorder, routes: "list[str]", concurrency: int, tasks: list, func) -> None:
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(func, tasks))
+    recorder.phase(routes, time.perf_counter() - start)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--teams", type=int, default=20, help="number of teams (N)")
+    parser.add_argument("--challenges", type=int, default=4, help="number of container challenges (M)")
+    parser.add_argument("--servers", type=int, default=2, help="number of fake Docker servers")
+    parser.add_argument("--latency", type=float, default=0.005, help="seconds per fake Docker API call")
+    parser.add_argument("--run-latency", type=float, default=0.2, help="seconds to start a fake container")
+    parser.add_argument("--concurrency", type=int, default=32, help="concurrent simulated players")
+    parser.add_argument("--views", type=int, default=5, help="view_info calls per player")
+    parser.add_argument("--listings", type=int, default=10, help="admin running_containers calls")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    # Every Docker client the plugin creates talks to an in-memory daemon instead
+    docker.DockerClient = fake_docker.FakeDockerClient
+    for index in range(args.servers):
+        fake_docker.get_daemon(f"unix:///benchmark/{index}.sock", args.latency, args.run_latency, {BENCHMARK_IMAGE})
+
+    recorder = Recorder()
+    with tempfile.TemporaryDirectory() as directory:
+        app = create_benchmark_app(os.path.join(directory, "benchmark.db"))
+        populate(app, args.teams, args.challenges)
+        container_manager = app.extensions["containers"]
+
+        admin, admin_headers = login(app, "admin", "10.255.255.254")
+        configure_servers(admin, admin_headers, args.servers)
+
+        players = []
+        for team_index in range(args.teams):
+            for member in range(args.challenges):
+                client, headers = login(app, f"player-{team_index}-{member}",
+                                        f"10.{team_index // 250}.{team_index % 250}.{member + 1}")
+                # Challenge ids follow creation order, player m of every team starts challenge m
+                players.append((client, headers, member + 1))
+
+        def request_container(player):
+            client, headers, chal_id = player
+            start = time.perf_counter()
+            response = recorder.timed("POST /api/request", lambda: client.post(
+                "/containers/api/request", json={"chal_id": chal_id}, headers=headers))
+            job_id = (response.get_json(silent=True) or {}).get("job_id")
+            while job_id is not None and time.perf_counter() - start < POLL_TIMEOUT:
+                response = client.get(f"/containers/api/request/{job_id}", headers=headers)
+                if (response.get_json(silent=True) or {}).get("status") not in ("queued", "running"):
+                    break
+                time.sleep(POLL_INTERVAL)
+            ready = response.status_code < 400 and "error" not in (response.get_json(silent=True) or {})
+            recorder.record("spawn until ready", time.perf_counter() - start, ready)
+
+        def view_info(player):
+            client, headers, chal_id = player
+            etag = None
+            for _ in range(args.views):
+                # Revalidate like the browser does, unchanged containers come back as 304
+                conditional = {**headers, "If-None-Match": etag} if etag else headers
+                response = recorder.timed("GET /api/view_info", lambda: client.get(
+                    f"/containers/api/view_info/{chal_id}", headers=conditional))
+                etag = response.headers.get("ETag") or etag
+
+        def renew(player):
+            client, headers, chal_id = player
+            recorder.timed("POST /api/renew", lambda: client.post(
+                "/containers/api/renew", json={"chal_id": chal_id}, headers=headers))
+
+        def list_containers(_):
+            recorder.timed("GET /api/running_containers", lambda: admin.get(
+                "/containers/api/running_containers", headers=admin_headers))
+
+        def stop(player):
+            client, headers, chal_id = player
+            recorder.timed("POST /api/stop", lambda: client.post(
+                "/containers/api/stop", json={"chal_id": chal_id}, headers=headers))
+
+        run_phase(recorder, ["POST /api/request", "spawn until ready"], args.concurrency, players, request_container)
+        run_phase(recorder, ["GET /api/view_info"], args.concurrency, players, view_info)
+        run_phase(recorder, ["POST /api/renew"], args.concurrency, players, renew)
+        run_phase(recorder, ["GET /api/running_containers"], 1, range(args.listings), list_containers)
+        # Half the players stop their container, the reaper expires the rest in one pass
+        run_phase(recorder, ["POST /api/stop"], args.concurrency, players[::2], stop)
+
+        from CTFd.models import db
+        from ..models import ContainerInfoModel
+        with app.app_context():
+            remaining = ContainerInfoModel.query.update({"expires": int(time.time()) - 1})
+            db.session.commit()
+        start = time.perf_counter()
+        container_manager.kill_expired_containers(app)
+        reaper_seconds = time.perf_counter() - start
+        recorder.record("expiry reaper", reaper_seconds, True)
+        recorder.phase(["expiry reaper"], reaper_seconds)
+        container_manager.shutdown()
+
+    results = recorder.summary()
+    # A single reaper pass, so its useful rate is containers reaped per second
+    results["expiry reaper"]["containers"] = remaining
+    results["expiry reaper"]["throughput_per_s"] = round(remaining / reaper_seconds, 2) if reaper_seconds else 0.0
+    print(f"{'route':<32}{'count':>8}{'errors':>8}{'p50 ms':>10}{'p99 ms':>10}{'per s':>10}")
+    for route, result in results.items():
+        print(f"{route:<32}{result['count']:>8}{result['errors']:>8}{result['p50_ms']:>10}"
+              f"{result['p99_ms']:>10}{result['throughput_per_s']:>10}")
+    if args.json:
+        with open(args.json, "w") as output:
+            json.dump({"parameters": vars(args), "results": results}, output, indent=2)
+
+
+if __name__ == "__main__":
+    main()
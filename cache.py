@@ -0,0 +1,39 @@
+import threading
+import time
+
+
+class TTLCache:
+    """
+    Small thread-safe in-process cache. Entries are dropped explicitly when the data they were built from
+    changes in this process, and expire after ttl seconds so changes made through other CTFd workers are
+    picked up as well.
+    """
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = {}
+
+    def get(self, key, loader):
+        """
+        Return the cached value for key, calling loader() to build it when missing or expired.
+        A None result is not cached, so objects created later are found right away.
+        """
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+        if entry is not None and entry[1] > now:
+            return entry[0]
+
+        value = loader()
+        if value is not None:
+            with self.lock:
+                self.entries[key] = (value, now + self.ttl)
+        return value
+
+    def invalidate(self, key=None) -> None:
+        """Drop one entry, or every entry when no key is given."""
+        with self.lock:
+            if key is None:
+                self.entries.clear()
+            else:
+                self.entries.pop(key, None)
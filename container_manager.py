@@ -1,18 +1,131 @@
 import atexit
+import datetime
+import logging
+import math
 import time
 import json
 
 from flask import Flask
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.schedulers import SchedulerNotRunningError
+from apscheduler.jobstores.base import JobLookupError
 import docker
 import paramiko.ssh_exception
 import requests
-import socket
 import random
+import threading
+import uuid
+from collections import namedtuple
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy.exc import IntegrityError
 
 from CTFd.models import db
-from .models import ContainerInfoModel
+from .models import ContainerChallengeModel, ContainerEventModel, ContainerInfoModel, ContainerJobModel, ContainerLeaseModel, ContainerPoolModel, ContainerReplicaModel, ContainerSpawnLockModel
+from .port_allocator import PortAllocator
+from .metrics import MetricsRegistry
+from .feed import ContainerFeed, FEED_RETENTION
+from .log import logger, log_context, log_sampled
+
+# Label attached to every container started by this plugin, used to find them in bulk
+CONTAINER_LABEL = "ctfd.containers"
+
+# Default number of pooled HTTP/SSH connections kept open per Docker server
+DEFAULT_POOL_SIZE = 10
+# Seconds between background health checks of the Docker servers
+HEALTH_CHECK_INTERVAL = 10
+# Reconnect backoff bounds (in seconds) for servers that failed a health check
+RECONNECT_BACKOFF_MIN = 5
+RECONNECT_BACKOFF_MAX = 300
+
+# Longest the expiry reaper sleeps between runs, even when no container is due sooner
+EXPIRATION_MAX_SLEEP = 60
+# Expired containers handled per reaper transaction
+EXPIRATION_BATCH_SIZE = 200
+# Seconds before the reaper retries expired containers it could not kill, e.g. while their server is down
+EXPIRATION_RETRY_DELAY = 10
+# Concurrent kill requests sent to a single Docker server by a batch kill
+KILL_WORKERS_PER_SERVER = 8
+# Container ids per bulk DELETE, kept below the bound parameter limits of the supported databases
+KILL_BATCH_SIZE = 500
+
+# Seconds between warm pool refills (a refill is also triggered whenever a warm container is claimed)
+WARM_POOL_REFILL_INTERVAL = 15
+# Concurrent container starts issued while refilling warm pools
+WARM_POOL_WORKERS = 4
+# Seconds between runs of the job expiring leases and scaling the replicas of shared challenges
+REPLICA_SCALE_INTERVAL = 10
+# Idle containers tried when claiming, in case other workers win the race for the first ones
+WARM_POOL_CLAIM_ATTEMPTS = 5
+
+# Worker threads running queued jobs (spawns, warmups) in each CTFd process
+JOB_WORKERS = 8
+# Container starts allowed to run at the same time on a single Docker server
+SPAWN_CONCURRENCY_PER_SERVER = 4
+# Seconds without progress after which an unfinished job is considered lost (e.g. its worker process restarted)
+JOB_TIMEOUT = 300
+# Seconds finished jobs are kept so clients can still poll their result
+JOB_RETENTION = 600
+# Attempts at taking or joining a coalesced job before giving up
+JOB_COALESCE_ATTEMPTS = 5
+
+# Host ports handed out to containers when the container_port_range setting is empty
+DEFAULT_PORT_RANGE = (30000, 65535)
+# Ports tried per container start before giving up, when Docker reports the chosen one as taken
+PORT_ALLOCATION_ATTEMPTS = 10
+
+# Server spec meaning a challenge may be placed on any Docker server
+ANY_SERVER = "*"
+# Seconds the per-server image inventory is cached before being listed again
+IMAGE_INVENTORY_TTL = 60
+# Concurrent image pulls issued by a warmup
+WARMUP_WORKERS = 8
+
+# Fraction of container starts logged at INFO, every start is logged at DEBUG
+SPAWN_LOG_SAMPLE_RATE = 0.1
+
+# Docker events that change the state of a plugin container
+CONTAINER_EVENTS = ["start", "die", "oom", "destroy"]
+# Seconds a removed container stays in the state cache, so a start returning after its destroy event sees it
+REMOVED_STATE_TTL = 60
+
+# Bounds of the retry delay suggested when every eligible server is at capacity
+CAPACITY_RETRY_MIN = 5
+CAPACITY_RETRY_MAX = 60
+# Limits understood in the docker_server_limits setting: containers, MiB of container memory, CPU cores
+SERVER_LIMIT_KEYS = ("containers", "memory", "cpus")
+
+# Spawn modes of a container challenge: a container per team (or user), or leases on shared replicas
+TEAM_SPAWN_MODE = "team"
+SHARED_SPAWN_MODE = "shared"
+SPAWN_MODES = (TEAM_SPAWN_MODE, SHARED_SPAWN_MODE)
+# Seconds after which a request for a shared challenge whose first replica another worker is starting retries
+REPLICA_START_RETRY_AFTER = 5
+
+# Tables whose rows point at a container and go away with it
+CONTAINER_MODELS = (ContainerInfoModel, ContainerPoolModel, ContainerReplicaModel, ContainerLeaseModel)
+
+# Errors raised when a Docker daemon cannot be reached
+CONNECTION_ERRORS = (
+    docker.errors.DockerException,
+    requests.exceptions.RequestException,
+    paramiko.ssh_exception.SSHException,
+    OSError,
+)
+
+# Result of a container start: the container id, its published host port and the server it runs on
+SpawnedContainer = namedtuple("SpawnedContainer", ["id", "port", "server"])
+
+# Resources of one container: memory in MB and CPUs (0 for no limit) count against server capacity, the
+# pids limit, ulimits, tmpfs mounts and writable layer size in MB only go to Docker
+ResourceProfile = namedtuple("ResourceProfile", ["memory", "cpus", "pids", "ulimits", "tmpfs", "storage"])
+
+def normalize_image_tag(image: str) -> str:
+    """Docker treats an image without a tag as :latest"""
+    if ":" not in image.rsplit("/", 1)[-1]:
+        return image + ":latest"
+    return image
 
 """ To those who will just copy instead of forking, atleast give credits to the author and change your commit messages ;) """
 class ContainerException(Exception):
@@ -29,14 +142,136 @@ class ContainerException(Exception):
         else:
             return "Unknown Container Exception"
 
+class CapacityException(ContainerException):
+    """Every eligible server is at its configured limits; the request may be retried after retry_after seconds."""
+    def __init__(self, retry_after: int, message: str = None) -> None:
+        super().__init__(message or f"All servers for this challenge are at capacity, please retry in {retry_after} seconds")
+        self.retry_after = retry_after
+
+class DockerServer:
+    """
+    A single Docker daemon with its persistent client and health state.
+
+    The client keeps its HTTP/SSH connection pool open between requests; the health check loop in
+    ContainerManager is the only place that pings the daemon or reconnects it.
+    """
+    def __init__(self, name: str, base_url: str, pool_size: int):
+        self.name = name
+        self.base_url = base_url
+        self.pool_size = pool_size
+        self.client = None
+        self.healthy = False
+        self.failures = 0
+        self.next_retry = 0.0
+        self.last_error = None
+        self.spawn_slots = threading.BoundedSemaphore(SPAWN_CONCURRENCY_PER_SERVER)
+        # Created on the first container start, see ContainerManager.get_port_allocator
+        self.ports = None
+        # Container states fed by the Docker events stream, only trusted while synced is set
+        self.states = {}
+        # Ids of removed containers, in removal order, with the monotonic time of their destroy event
+        self.removed = {}
+        self.synced = False
+        self.events = None
+        # Container starts in progress from this process, and the totals reported by the daemon
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.pending_memory = 0
+        self.pending_cpus = 0
+        self.memory = 0
+        self.cpus = 0
+
+    def connect(self) -> None:
+        self.close()
+        try:
+            client = docker.DockerClient(
+                base_url=self.base_url, max_pool_size=self.pool_size)
+            client.ping()
+            info = client.info()
+        except docker.errors.DockerException as e:
+            raise ContainerException("CTFd could not connect to Docker")
+        except TimeoutError as e:
+            raise ContainerException("CTFd timed out when connecting to Docker")
+        except paramiko.ssh_exception.NoValidConnectionsError as e:
+            raise ContainerException(
+                "CTFd timed out when connecting to Docker: " + str(e)
+            )
+        except paramiko.ssh_exception.AuthenticationException as e:
+            raise ContainerException(
+                "CTFd had an authentication error when connecting to Docker: " + str(e)
+            )
+        self.client = client
+        self.memory = info.get("MemTotal", 0)
+        self.cpus = info.get("NCPU", 0)
+        self.healthy = True
+        self.failures = 0
+        self.last_error = None
+
+    def check(self) -> None:
+        """Ping a healthy server, or reconnect an unhealthy one once its backoff has elapsed."""
+        if self.healthy:
+            try:
+                self.client.ping()
+                return
+            except CONNECTION_ERRORS as e:
+                self.mark_down(e)
+                return
+
+        if time.time() < self.next_retry:
+            return
+        try:
+            self.connect()
+            logger.info("Reconnected to Docker server %s", self.name)
+        except ContainerException as e:
+            self.mark_down(e)
+
+    def mark_down(self, error) -> None:
+        if self.healthy:
+            logger.warning("Docker server %s is down: %s", self.name, error)
+        self.healthy = False
+        self.failures += 1
+        self.last_error = str(error)
+        self.next_retry = time.time() + min(
+            RECONNECT_BACKOFF_MAX, RECONNECT_BACKOFF_MIN * 2 ** (self.failures - 1))
+
+    def close(self) -> None:
+        self.synced = False
+        if self.events is not None:
+            try:
+                self.events.close()
+            except Exception:
+                pass
+            self.events = None
+        if self.client is not None:
+            try:
+                self.client.close()
+            except Exception:
+                pass
+        self.client = None
+
 class ContainerManager:
     client = {}
     def __init__(self, settings, app):
         self.settings = settings
         self.client = None
+        self.servers = {}
         self.app = app
-        self.images_list = []
-        self.len_images_list = 0
+        self.image_lock = threading.Lock()
+        self.image_refresh_lock = threading.Lock()
+        self.image_inventory = {}
+        self.image_inventory_expires = 0
+        self.image_refreshing = False
+        self.job_executor = ThreadPoolExecutor(max_workers=JOB_WORKERS)
+        self.port_lock = threading.Lock()
+        # Host port of every container started by this process, released when the container is killed
+        self.container_ports = {}
+        # Public hostname of every configured server, resolved once per settings change
+        self.server_hostnames = {}
+        self.server_limits = {}
+        # Container changes streamed to open admin dashboards
+        self.feed = ContainerFeed(app)
+        self.__register_metrics()
+        atexit.register(self.shutdown)
         if settings.get("docker_servers") is None or settings.get("servers") == "":
             return
 
@@ -45,31 +280,57 @@ class ContainerManager:
         try:
             self.initialize_connection(settings, app)
         except ContainerException:
-            print("Docker could not initialize or connect.")
+            logger.error("Docker could not initialize or connect")
             return
         
-    def __check_port__(self, port: int) -> bool:
-        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        s.settimeout(1)
-        try:
-            s.bind(("0.0.0.0", port))
-            s.close()
-            return True
-        except Exception as e:
-            print(f"Error when fetching port: {e}")
-        return False
+    def __register_metrics(self) -> None:
+        self.metrics = MetricsRegistry()
+        self.docker_latency = self.metrics.histogram(
+            "ctfd_containers_docker_request_seconds", "Latency of Docker API calls", ("operation", "server"))
+        self.docker_errors = self.metrics.counter(
+            "ctfd_containers_docker_errors_total", "Failed Docker API calls", ("operation", "server"))
+        self.containers_created = self.metrics.counter(
+            "ctfd_containers_created_total", "Containers started on Docker, including warm pool ones", ("server",))
+        self.spawn_failures = self.metrics.counter(
+            "ctfd_containers_spawn_failures_total", "Container starts that failed", ("server", "reason"))
+        self.containers_expired = self.metrics.counter(
+            "ctfd_containers_expired_total", "Containers killed by the expiry reaper")
+        self.reaper_duration = self.metrics.histogram(
+            "ctfd_containers_reaper_seconds", "Duration of expiry reaper runs")
+        self.live_containers = self.metrics.gauge(
+            "ctfd_containers_live", "Team containers recorded on each server", ("server",))
+        self.live_challenge_containers = self.metrics.gauge(
+            "ctfd_containers_live_by_challenge", "Team containers recorded for each challenge", ("challenge_id",))
+        self.idle_containers = self.metrics.gauge(
+            "ctfd_containers_warm_pool_idle", "Idle warm pool containers on each server", ("server",))
+        self.server_up = self.metrics.gauge(
+            "ctfd_containers_server_up", "Whether the Docker server passed its last health check", ("server",))
+        self.spawn_jobs_in_flight = self.metrics.gauge(
+            "ctfd_containers_spawn_jobs_in_flight", "Spawn requests queued or running in any worker")
+
+    def render_metrics(self) -> str:
+        """Refresh the gauges from the database and server state, then render every metric as Prometheus text."""
+        for gauge, model, column in (
+                (self.live_containers, ContainerInfoModel, ContainerInfoModel.server),
+                (self.live_challenge_containers, ContainerInfoModel, ContainerInfoModel.challenge_id),
+                (self.idle_containers, ContainerPoolModel, ContainerPoolModel.server)):
+            gauge.replace({(key,): count for key, count in
+                db.session.query(column, db.func.count(model.container_id)).group_by(column)})
+        self.server_up.replace({(name,): int(server.healthy) for name, server in self.servers.items()})
+        self.spawn_jobs_in_flight.set(ContainerJobModel.query.filter(
+            ContainerJobModel.kind == "spawn",
+            ContainerJobModel.status != "finished",
+            ContainerJobModel.timestamp >= int(time.time()) - JOB_TIMEOUT,
+        ).count())
+        return self.metrics.render()
 
     def initialize_connection(self, settings, app) -> None:
         self.settings = settings
         self.app = app
         self.client = {}
-        # Remove any leftover expiration schedulers
-        try:
-            self.expiration_scheduler.shutdown()
-        except (SchedulerNotRunningError, AttributeError):
-            # Scheduler was never running
-            pass
+        self.image_inventory_expires = 0
+        # Remove any leftover schedulers and connections
+        self.shutdown()
 
         server = json.loads(settings.get("docker_servers","{}"))
 
@@ -77,213 +338,1393 @@ class ContainerManager:
             self.client = None
             return
 
+        self.server_hostnames = {
+            name: self.__resolve_hostname(server_url) for name, server_url in server.items()}
+        self.server_limits = self.parse_server_limits(settings.get("docker_server_limits"))
+
+        try:
+            pool_size = int(settings.get("docker_pool_size") or DEFAULT_POOL_SIZE)
+        except ValueError:
+            pool_size = DEFAULT_POOL_SIZE
+
+        errors = []
         for name,server_url in server.items():
-            print(f"Connecting to Docker server: ", server_url)
+            logger.debug("Connecting to Docker server %s at %s", name, server_url)
+            docker_server = DockerServer(name, server_url, pool_size)
+            self.servers[name] = docker_server
             try:
-                client = docker.DockerClient(base_url=server_url)
-                client.ping()
-                print(f"Connected to Docker server: ", server_url)
-                self.client[name] = client 
-            except docker.errors.DockerException as e:
-                self.client = None
-                raise ContainerException("CTFd could not connect to Docker")
-            except TimeoutError as e:
-                self.client = None
-                raise ContainerException("CTFd timed out when connecting to Docker")
-            except paramiko.ssh_exception.NoValidConnectionsError as e:
-                self.client = None
-                raise ContainerException(
-                    "CTFd timed out when connecting to Docker: " + str(e)
-                )
-            except paramiko.ssh_exception.AuthenticationException as e:
-                self.client = None
-                raise ContainerException(
-                    "CTFd had an authentication error when connecting to Docker: " + str(e)
-                )
+                docker_server.connect()
+                logger.info("Connected to Docker server %s", name)
+            except ContainerException as e:
+                # The health check loop keeps retrying this server with backoff
+                docker_server.mark_down(e)
+                errors.append(f"{name}: {e}")
+        self.__refresh_clients()
 
-            # Set up expiration scheduler
-            try:
-                self.expiration_seconds = int(
-                    settings.get("container_expiration", 0)) * 60
-            except (ValueError, AttributeError):
-                self.expiration_seconds = 0
+        # Set up expiration scheduler
+        try:
+            self.expiration_seconds = int(
+                settings.get("container_expiration", 0)) * 60
+        except (ValueError, AttributeError):
+            self.expiration_seconds = 0
 
-            EXPIRATION_CHECK_INTERVAL = 5
+        self.scheduler = BackgroundScheduler()
+        self.scheduler.add_job(
+            func=self.check_servers, trigger="interval", seconds=HEALTH_CHECK_INTERVAL, id="health_check")
+        if self.expiration_seconds > 0:
+            # The reaper reschedules itself to the next deadline after every run
+            self.scheduler.add_job(
+                func=self.kill_expired_containers, args=(app,), trigger="interval", seconds=EXPIRATION_MAX_SLEEP,
+                id="expiry", next_run_time=datetime.datetime.now())
+        self.scheduler.add_job(
+            func=self.refill_warm_pools, trigger="interval", seconds=WARM_POOL_REFILL_INTERVAL, id="warm_pool")
+        # Shared replicas follow their leases whether or not containers expire
+        self.scheduler.add_job(
+            func=self.maintain_replicas, trigger="interval", seconds=REPLICA_SCALE_INTERVAL, id="replicas")
+        self.scheduler.add_job(
+            func=self.delete_old_jobs, trigger="interval", seconds=JOB_RETENTION, id="job_cleanup")
+        self.scheduler.start()
 
-            if self.expiration_seconds > 0:
-                self.expiration_scheduler = BackgroundScheduler()
-                self.expiration_scheduler.add_job(
-                    func=self.kill_expired_containers, args=(app,), trigger="interval", seconds=EXPIRATION_CHECK_INTERVAL)
-                self.expiration_scheduler.start()
+        self.stop_event = threading.Event()
+        for docker_server in self.servers.values():
+            threading.Thread(
+                target=self.listen_events, args=(docker_server, self.stop_event),
+                name=f"container-events-{docker_server.name}", daemon=True).start()
+
+        if errors:
+            raise ContainerException("; ".join(errors))
+
+    def shutdown(self) -> None:
+        try:
+            self.scheduler.shutdown(wait=False)
+        except (SchedulerNotRunningError, AttributeError):
+            # Scheduler was never running
+            pass
+        try:
+            self.stop_event.set()
+        except AttributeError:
+            pass
+        for server in self.servers.values():
+            server.close()
+        self.servers = {}
+
+    def check_servers(self) -> None:
+        """Background health check: marks each server up or down and reconnects failed ones with backoff."""
+        for server in list(self.servers.values()):
+            server.check()
+        self.__refresh_clients()
+
+    def request_health_check(self) -> None:
+        """Run the health check loop as soon as possible instead of waiting for the next interval."""
+        try:
+            self.scheduler.modify_job("health_check", next_run_time=datetime.datetime.now())
+        except (JobLookupError, AttributeError):
+            pass
 
-                # Shut down the scheduler when exiting the app
-                atexit.register(lambda: self.expiration_scheduler.shutdown())
+    def __refresh_clients(self) -> None:
+        # Swap in a new dict rather than mutating, so request threads iterating the old one are unaffected
+        self.client = {
+            name: server.client for name, server in self.servers.items() if server.healthy
+        }
 
-    # TODO: Fix this cause it doesn't work
     def run_command(func):
         def wrapper_run_command(self, *args, **kwargs):
-            for client in self.client.values():
-                if client is None:
-                    try:
-                        self.__init__(self.settings, self.app)
-                    except:
-                        raise ContainerException("Docker is not connected")
-                try:
-                    if client is None:
-                        raise ContainerException("Docker is not connected")
-                    if client.ping():
-                        return func(self, *args, **kwargs)
-                except (paramiko.ssh_exception.SSHException, ConnectionError, requests.exceptions.ConnectionError) as e:
-                    # Try to reconnect before failing
-                    try:
-                        self.__init__(self.settings, self.app)
-                    except:
-                        pass
-                    raise ContainerException(
-                        "Docker connection was lost. Please try your request again later.")
+            # Server health is tracked by the background loop, so request paths never ping inline
+            if not self.client:
+                raise ContainerException("Docker is not connected")
+            try:
+                return func(self, *args, **kwargs)
+            except (paramiko.ssh_exception.SSHException, ConnectionError, requests.exceptions.ConnectionError) as e:
+                self.request_health_check()
+                raise ContainerException(
+                    "Docker connection was lost. Please try your request again later.")
         return wrapper_run_command
 
-    @run_command
     def kill_expired_containers(self, app: Flask):
-        with self.app.app_context():
-            containers: "list[ContainerInfoModel]" = ContainerInfoModel.query.all()
+        """
+        Expiry reaper. Uses the index on ContainerInfoModel.expires to fetch only expired rows, kills their
+        containers in parallel, deletes the rows of the ones that are gone and then sleeps until the next deadline.
+        """
+        next_expiry = None
+        try:
+            with self.app.app_context(), self.reaper_duration.time():
+                # Containers that could not be killed keep their row and are retried on the next run
+                failed = set()
+                while True:
+                    query = db.session.query(ContainerInfoModel.container_id, ContainerInfoModel.server) \
+                        .filter(ContainerInfoModel.expires < int(time.time()))
+                    if failed:
+                        query = query.filter(ContainerInfoModel.container_id.notin_(failed))
+                    expired = {row.container_id: row.server for row in query.limit(EXPIRATION_BATCH_SIZE)}
+                    if not expired:
+                        break
 
-            for container in containers:
-                delta_seconds = container.expires - int(time.time())
-                if delta_seconds < 0:
+                    # Kill first, kill_containers then deletes the rows of the containers that are gone only
                     try:
-                        self.kill_container(container.container_id)
+                        results = self.kill_containers(expired, reason="expired")
                     except ContainerException:
-                        print(
-                            "[Container Expiry Job] Docker is not initialized. Please check your settings.")
+                        logger.error("Container expiry job: Docker is not initialized, please check your settings")
+                        break
+                    for container_id, result in results.items():
+                        if "error" in result:
+                            failed.add(container_id)
+                            logger.warning("Container expiry job: %s", result["error"])
+                    self.containers_expired.inc(sum(1 for result in results.values() if "success" in result))
 
-                    db.session.delete(container)
-                    db.session.commit()
+                next_expiry = db.session.query(db.func.min(ContainerInfoModel.expires)).scalar()
+                if failed and next_expiry is not None:
+                    # The failed rows are still expired, retry them later rather than right away
+                    next_expiry = max(next_expiry, int(time.time()) + EXPIRATION_RETRY_DELAY)
+        finally:
+            now = int(time.time())
+            if next_expiry is None or next_expiry > now + EXPIRATION_MAX_SLEEP:
+                next_expiry = now + EXPIRATION_MAX_SLEEP
+            self.__reschedule_expiry(next_expiry, only_earlier=False)
 
-    @run_command
-    def is_container_running(self, container_id: str) -> bool:
-        for client in self.client.values():
-            container = client.containers.list(filters={"id": container_id})
-            if len(container) == 0:
-                return False
-            return container[0].status == "running"
+    def schedule_expiry(self, expires: int) -> None:
+        """Wake the expiry reaper at the given unix time if that is earlier than its next scheduled run."""
+        self.__reschedule_expiry(expires, only_earlier=True)
 
-    @run_command
-    def create_container(self, chal_id: str, team_id: str, user_id: str, image: str, port: int, command: str, volumes: str, server: str):
-        for name,client_name in self.client.items():
-            print(f"Client: {client_name}")
-            print(f"Server: {server}")           
-            if server==name:
-                print(f"Using server {name} for challenge {chal_id} for team {team_id} spawned by {user_id}")
-                client = client_name
-        kwargs = {}
+    def __reschedule_expiry(self, expires: int, only_earlier: bool) -> None:
+        try:
+            job = self.scheduler.get_job("expiry")
+        except AttributeError:
+            return
+        if job is None:
+            return
+        # A run time in the past would be treated as a misfire, so never schedule before now
+        run_at = datetime.datetime.fromtimestamp(
+            max(expires, time.time()), tz=datetime.timezone.utc)
+        if only_earlier and job.next_run_time is not None and job.next_run_time <= run_at:
+            return
+        try:
+            job.modify(next_run_time=run_at)
+        except JobLookupError:
+            pass
+
+    def __kill_quietly(self, containers: "dict[str, str]", job: str, reason: "str|None" = "killed") -> None:
+        try:
+            results = self.kill_containers(containers, reason)
+        except ContainerException:
+            logger.error("%s: Docker is not initialized, please check your settings", job)
+            return
+        for container_id, result in results.items():
+            if "error" in result:
+                logger.warning("%s: %s", job, result["error"])
+
+    def refill_warm_pools(self) -> None:
+        """
+        Background job keeping each challenge's warm pool at its configured size. Idle containers that died,
+        run an outdated image or sit on the wrong server are replaced, and surplus ones are killed.
+        """
+        if not self.client:
+            return
+
+        with self.app.app_context():
+            # Every worker runs this job, only one at a time works out and starts the missing containers
+            if not self.acquire_lock("warm_pool"):
+                return
+            try:
+                snapshot_time = int(time.time())
+                try:
+                    statuses = self.get_containers_status()
+                except ContainerException:
+                    return
+
+                # Shared challenges lease their replicas and never claim a warm container, their idle ones are killed
+                challenges = {
+                    challenge.id: challenge for challenge in ContainerChallengeModel.query.filter(
+                        ContainerChallengeModel.warm_pool_size > 0,
+                        db.or_(ContainerChallengeModel.spawn_mode.is_(None),
+                               ContainerChallengeModel.spawn_mode != SHARED_SPAWN_MODE))
+                }
+
+                pool_sizes = {}
+                stale = {}
+                for idle in ContainerPoolModel.query.order_by(ContainerPoolModel.timestamp):
+                    challenge = challenges.get(idle.challenge_id)
+                    # Only trust the status snapshot for healthy servers and containers that existed when it was taken
+                    is_dead = (idle.server in self.client and idle.timestamp < snapshot_time
+                        and statuses.get(idle.container_id) != "running")
+                    if (challenge is None or is_dead or idle.image != challenge.image
+                            or not self.is_eligible_server(challenge.server, idle.server)
+                            or pool_sizes.get(challenge.id, 0) >= challenge.warm_pool_size):
+                        stale[idle.container_id] = idle.server
+                    else:
+                        pool_sizes[challenge.id] = pool_sizes.get(challenge.id, 0) + 1
+
+                # Only kill the idle containers we removed ourselves; the others were just claimed by a team
+                removed = {container_id: server for container_id, server in stale.items() if ContainerPoolModel.query
+                    .filter_by(container_id=container_id).delete(synchronize_session=False) == 1}
+                db.session.commit()
+                # Idle containers are not on the dashboard, so there is nothing to announce
+                self.__kill_quietly(removed, "Warm pool job", reason=None)
+
+                spawns = []
+                for challenge in challenges.values():
+                    if not self.get_eligible_servers(challenge.server):
+                        continue
+                    missing = challenge.warm_pool_size - pool_sizes.get(challenge.id, 0)
+                    if missing <= 0:
+                        continue
+                    try:
+                        resources = self.get_resource_profile(challenge)
+                    except ContainerException as err:
+                        logger.warning("Warm pool job skips challenge %s: %s", challenge.id, err)
+                        continue
+                    spawns += [(challenge.id, challenge.image, challenge.port, challenge.command,
+                        challenge.volumes, challenge.server, resources)] * missing
+                if not spawns:
+                    return
+
+                def spawn(spec):
+                    chal_id, image, port, command, volumes, server, resources = spec
+                    try:
+                        with self.app.app_context():
+                            container = self.create_container(str(chal_id), "", "", image, port, command, volumes, server,
+                                resources=resources)
+                        return ContainerPoolModel(
+                            container_id=container.id,
+                            challenge_id=chal_id,
+                            image=image,
+                            port=container.port,
+                            server=container.server,
+                            timestamp=int(time.time()),
+                        )
+                    except ContainerException as err:
+                        logger.warning("Warm pool job could not start a container for challenge %s: %s", chal_id, err)
+                        return None
+
+                with ThreadPoolExecutor(max_workers=WARM_POOL_WORKERS) as executor:
+                    started = [idle for idle in executor.map(spawn, spawns) if idle is not None]
+                db.session.add_all(started)
+                db.session.commit()
+            finally:
+                self.release_lock("warm_pool")
+
+    def claim_warm_container(self, challenge: ContainerChallengeModel) -> "dict|None":
+        """
+        Take an idle container from the challenge's warm pool. The pool row is deleted in the caller's
+        transaction, so the claim becomes visible together with the caller's ContainerInfoModel insert.
+
+        :return: Dictionary with the container_id, port and server of the claimed container, or None if the pool is empty
+        """
+        candidates = ContainerPoolModel.query.filter(
+            ContainerPoolModel.challenge_id == challenge.id,
+            ContainerPoolModel.image == challenge.image,
+            ContainerPoolModel.server.in_(self.get_eligible_servers(challenge.server)),
+        ).order_by(ContainerPoolModel.timestamp).limit(WARM_POOL_CLAIM_ATTEMPTS).all()
+
+        for candidate in candidates:
+            claimed = {
+                "container_id": candidate.container_id,
+                "port": candidate.port,
+                "server": candidate.server,
+            }
+            # Deleting the row is the claim: exactly one worker sees a rowcount of 1
+            if ContainerPoolModel.query.filter_by(
+                    container_id=candidate.container_id).delete(synchronize_session=False) == 1:
+                return claimed
+        return None
+
+    def request_pool_refill(self) -> None:
+        """Refill the warm pools as soon as possible instead of waiting for the next interval."""
+        try:
+            self.scheduler.modify_job("warm_pool", next_run_time=datetime.datetime.now())
+        except (JobLookupError, AttributeError):
+            pass
+
+    @staticmethod
+    def get_wanted_replicas(challenge, leases: int) -> int:
+        """
+        Replicas a shared challenge needs for this many leases: none while unused, otherwise one for every
+        replica_teams leases (all of them when replica_teams is empty), at most replicas.
+        """
+        if leases <= 0:
+            return 0
+        maximum = max(challenge.replicas or 1, 1)
+        if not challenge.replica_teams:
+            return maximum
+        return min(maximum, math.ceil(leases / challenge.replica_teams))
+
+    def get_lease(self, challenge_id: int, xid: int, is_team: bool) -> "tuple[ContainerReplicaModel, ContainerLeaseModel]|None":
+        """The replica a team (or user) holds a lease on for a shared challenge, with the lease."""
+        query = ContainerLeaseModel.query.filter_by(challenge_id=challenge_id)
+        lease = query.filter_by(team_id=xid).first() if is_team else query.filter_by(user_id=xid).first()
+        if lease is None:
+            return None
+        replica = ContainerReplicaModel.query.filter_by(container_id=lease.container_id).first()
+        if replica is None:
+            # The replica died or was scaled away, the team asks for a new lease
+            ContainerLeaseModel.query.filter_by(id=lease.id).delete(synchronize_session=False)
+            db.session.commit()
+            return None
+        return replica, lease
+
+    def lease_replica(self, challenge, team_id: "int|None", user_id: int, expires: int) -> "tuple[ContainerReplicaModel, ContainerLeaseModel]":
+        """
+        Lease the least used replica of a shared challenge, starting the first replica if there is none yet.
+        Further replicas are started by the replicas job, which is woken up when demand calls for them.
+        Must be called inside an app context.
+
+        :raises CapacityException: When another worker is starting the first replica, rather than holding a job
+            worker until it is up
+        """
+        replica, leases, active = self.__pick_replica(challenge.id)
+        if replica is None:
+            if not self.ensure_replicas(challenge, 1):
+                raise CapacityException(
+                    REPLICA_START_RETRY_AFTER, "The shared instance is still starting, please wait a moment")
+            replica, leases, active = self.__pick_replica(challenge.id)
+            if replica is None:
+                raise ContainerException("The shared instance could not be started, please try again.")
+
+        lease = ContainerLeaseModel(
+            container_id=replica.container_id,
+            challenge_id=challenge.id,
+            team_id=team_id,
+            user_id=user_id,
+            timestamp=int(time.time()),
+            expires=expires,
+        )
+        db.session.add(lease)
+        db.session.commit()
+        if active < self.get_wanted_replicas(challenge, leases + 1):
+            self.request_replica_scaling()
+        return replica, lease
+
+    def __pick_replica(self, challenge_id: int) -> "tuple[ContainerReplicaModel|None, int, int]":
+        """
+        Least-connections choice among the replicas taking new leases on healthy servers, ties broken at random.
+
+        :return: The replica (None when there is none), the challenge's lease count and its active replica count
+        """
+        loads = dict(db.session.query(ContainerLeaseModel.container_id, db.func.count(ContainerLeaseModel.id))
+            .filter(ContainerLeaseModel.challenge_id == challenge_id).group_by(ContainerLeaseModel.container_id))
+        replicas = [replica for replica in ContainerReplicaModel.query.filter_by(
+            challenge_id=challenge_id, draining=False) if replica.server in (self.client or {})]
+        if not replicas:
+            return None, sum(loads.values()), 0
+        least = min(loads.get(replica.container_id, 0) for replica in replicas)
+        replica = random.choice([replica for replica in replicas if loads.get(replica.container_id, 0) == least])
+        return replica, sum(loads.values()), len(replicas)
+
+    def ensure_replicas(self, challenge, wanted: int) -> bool:
+        """
+        Bring a shared challenge up to the wanted number of replicas taking leases, reusing draining ones
+        before starting new ones on the servers without a replica yet. Only one worker at a time does this
+        per challenge.
+
+        :return: False when another worker is already at it
+        """
+        key = f"replica:{challenge.id}"
+        if not self.acquire_lock(key):
+            return False
+
+        try:
+            replicas = ContainerReplicaModel.query.filter_by(challenge_id=challenge.id).all()
+            missing = wanted - sum(1 for replica in replicas if not replica.draining)
+            for replica in replicas:
+                if missing > 0 and replica.draining:
+                    replica.draining = False
+                    missing -= 1
+            db.session.commit()
+
+            resources = self.get_resource_profile(challenge)
+            hosting = {replica.server for replica in replicas}
+            for _ in range(missing):
+                # Spread the replicas over the servers, doubling up only when every eligible one has one
+                spread = [name for name in self.get_eligible_servers(challenge.server) if name not in hosting]
+                try:
+                    container = self.create_container(
+                        str(challenge.id), "", "", challenge.image, challenge.port, challenge.command,
+                        challenge.volumes, ",".join(spread) if spread else challenge.server, resources=resources)
+                except CapacityException:
+                    if not spread:
+                        raise
+                    container = self.create_container(
+                        str(challenge.id), "", "", challenge.image, challenge.port, challenge.command,
+                        challenge.volumes, challenge.server, resources=resources)
+                db.session.add(ContainerReplicaModel(
+                    container_id=container.id,
+                    challenge_id=challenge.id,
+                    port=container.port,
+                    server=container.server,
+                    draining=False,
+                    timestamp=int(time.time()),
+                ))
+                db.session.commit()
+                hosting.add(container.server)
+        finally:
+            self.release_lock(key)
+        return True
+
+    def maintain_replicas(self) -> None:
+        """
+        Background job expiring the leases on shared replicas, which needs no Docker call, then scaling the
+        replicas to the remaining leases. With container_expiration at 0 leases never expire.
+        """
+        if not self.client:
+            return
+        with self.app.app_context():
+            if self.expiration_seconds > 0:
+                ContainerLeaseModel.query.filter(
+                    ContainerLeaseModel.expires < int(time.time())).delete(synchronize_session=False)
+                db.session.commit()
+            self.scale_replicas()
+
+    def request_replica_scaling(self) -> None:
+        """Scale the shared replicas as soon as possible instead of waiting for the next interval."""
+        try:
+            self.scheduler.modify_job("replicas", next_run_time=datetime.datetime.now())
+        except (JobLookupError, AttributeError):
+            pass
+
+    def scale_replicas(self) -> None:
+        """
+        Match the replicas of every shared challenge to its leases. Missing replicas are started, surplus ones
+        are marked as draining so they get no new leases, and draining replicas left without leases since the
+        previous run are killed. Must be called inside an app context.
+        """
+        leases = dict(db.session.query(ContainerLeaseModel.container_id, db.func.count(ContainerLeaseModel.id))
+            .group_by(ContainerLeaseModel.container_id))
+        replicas = {}
+        for replica in ContainerReplicaModel.query:
+            replicas.setdefault(replica.challenge_id, []).append(replica)
+        challenges = {challenge.id: challenge for challenge in ContainerChallengeModel.query.filter(
+            ContainerChallengeModel.id.in_(list(replicas)))} if replicas else {}
+
+        # Decided before draining more, so a lease taken while a replica was being marked is still seen
+        unused = [replica for challenge_replicas in replicas.values() for replica in challenge_replicas
+            if replica.draining and not leases.get(replica.container_id)]
+
+        for challenge_id, challenge_replicas in replicas.items():
+            challenge = challenges.get(challenge_id)
+            if challenge is None or challenge.spawn_mode != SHARED_SPAWN_MODE:
+                wanted = 0
+            else:
+                wanted = self.get_wanted_replicas(
+                    challenge, sum(leases.get(replica.container_id, 0) for replica in challenge_replicas))
+            active = [replica for replica in challenge_replicas if not replica.draining]
+            if len(active) < wanted:
+                try:
+                    self.ensure_replicas(challenge, wanted)
+                except ContainerException as err:
+                    logger.warning("Replica scaling could not start a replica for challenge %s: %s", challenge_id, err)
+            elif len(active) > wanted:
+                # The least used replicas go first, their teams keep them until their leases expire
+                for replica in sorted(active, key=lambda replica: leases.get(replica.container_id, 0))[:len(active) - wanted]:
+                    replica.draining = True
+                db.session.commit()
+
+        # Deleting the row only while no lease points at it keeps a replica that was leased in the meantime
+        killed = {}
+        for replica in unused:
+            if ContainerReplicaModel.query.filter(
+                    ContainerReplicaModel.container_id == replica.container_id,
+                    ContainerReplicaModel.draining == True,
+                    ~db.session.query(ContainerLeaseModel.id).filter(
+                        ContainerLeaseModel.container_id == replica.container_id).exists(),
+            ).delete(synchronize_session=False) == 1:
+                killed[replica.container_id] = replica.server
+        db.session.commit()
+        self.__kill_quietly(killed, "Replica scaling job", reason=None)
+
+    def acquire_lock(self, key: str) -> bool:
+        """
+        Take a lock row shared by every CTFd worker, released by deleting the row. A lock older than JOB_TIMEOUT
+        was left behind by a worker that died and is cleared, so the next caller gets it. Must be called inside
+        an app context.
+
+        :return: False when another worker holds the lock
+        """
+        now = int(time.time())
+        db.session.add(ContainerSpawnLockModel(key=key, job_id="", timestamp=now))
+        try:
+            db.session.commit()
+            return True
+        except IntegrityError:
+            db.session.rollback()
+            ContainerSpawnLockModel.query.filter(
+                ContainerSpawnLockModel.key == key,
+                ContainerSpawnLockModel.timestamp < now - JOB_TIMEOUT,
+            ).delete(synchronize_session=False)
+            db.session.commit()
+            return False
+
+    def release_lock(self, key: str) -> None:
+        """Release a lock taken with acquire_lock. Anything left uncommitted by the failed holder is rolled back."""
+        db.session.rollback()
+        ContainerSpawnLockModel.query.filter_by(key=key).delete(synchronize_session=False)
+        db.session.commit()
+
+    def enqueue_job(self, func, kind: str = "spawn", challenge_id: int = None, team_id: int = None, user_id: int = None,
+            coalesce_key: str = None) -> str:
+        """
+        Record a job and run it on the bounded worker pool. The job is stored in the database so that any
+        CTFd worker process can answer status requests for it.
+
+        :param func: Callable taking the job id and returning a (JSON body, HTTP status code) tuple, run inside an app context
+        :param coalesce_key: While a job with this key is in flight, in any worker, its id is returned instead of
+            queueing another one, so concurrent callers share a single run and its result
+        :return: The id of the queued (or joined) job
+        """
+        for _ in range(JOB_COALESCE_ATTEMPTS):
+            now = int(time.time())
+            job = ContainerJobModel(
+                id=uuid.uuid4().hex,
+                kind=kind,
+                status="queued",
+                challenge_id=challenge_id,
+                team_id=team_id,
+                user_id=user_id,
+                timestamp=now,
+            )
+            db.session.add(job)
+            if coalesce_key is not None:
+                db.session.add(ContainerSpawnLockModel(key=coalesce_key, job_id=job.id, timestamp=now))
+            try:
+                db.session.commit()
+            except IntegrityError:
+                db.session.rollback()
+                in_flight_id = self.__join_in_flight_job(coalesce_key)
+                if in_flight_id is not None:
+                    return in_flight_id
+                # The lock was stale and has been cleared, or released in the meantime
+                continue
+
+            job_id = job.id
+            self.job_executor.submit(self.__run_job, job_id, func, coalesce_key)
+            return job_id
+        raise ContainerException("The server is busy, please try again.")
+
+    def __join_in_flight_job(self, coalesce_key: str) -> "str|None":
+        lock = ContainerSpawnLockModel.query.filter_by(key=coalesce_key).first()
+        if lock is None:
+            return None
+        job = self.get_job(lock.job_id)
+        if job is not None and job.status != "finished":
+            return job.id
+
+        # The job holding the lock is finished or lost but its worker never released it
+        ContainerSpawnLockModel.query.filter_by(
+            key=coalesce_key, job_id=lock.job_id).delete(synchronize_session=False)
+        db.session.commit()
+        return None
 
-        # Set the memory and CPU limits for the container
-        if self.settings.get("container_maxmemory"):
+    def __run_job(self, job_id: str, func, coalesce_key: str = None) -> None:
+        with self.app.app_context(), log_context(job=job_id):
+            self.update_job(job_id, status="running")
             try:
-                mem_limit = int(self.settings.get("container_maxmemory"))
-                if mem_limit > 0:
-                    kwargs["mem_limit"] = f"{mem_limit}m"
-            except ValueError:
-                ContainerException(
-                    "Configured container memory limit must be an integer")
-        if self.settings.get("container_maxcpu"):
+                result, result_code = func(job_id)
+            except Exception as err:
+                # A failed flush or commit leaves the session unusable until it is rolled back
+                db.session.rollback()
+                logger.exception("Job failed")
+                result, result_code = json.dumps({"error": str(err)}), 500
+            try:
+                if coalesce_key is not None:
+                    # Released in the same commit that publishes the result, so a joining caller always sees one of them
+                    ContainerSpawnLockModel.query.filter_by(
+                        key=coalesce_key, job_id=job_id).delete(synchronize_session=False)
+                self.update_job(job_id, status="finished", result=result, result_code=result_code)
+            except Exception:
+                # Finish the job on its own, a lock left behind is cleared by the next caller since its job is finished
+                logger.exception("Could not release the lock of the job")
+                db.session.rollback()
+                self.update_job(job_id, status="finished", result=result, result_code=result_code)
+
+    def update_job(self, job_id: str, **fields) -> None:
+        # The timestamp tracks the last progress, so long running jobs are not reported as lost
+        fields["timestamp"] = int(time.time())
+        ContainerJobModel.query.filter_by(id=job_id).update(fields, synchronize_session=False)
+        db.session.commit()
+
+    def get_job(self, job_id: str) -> "ContainerJobModel|None":
+        job = ContainerJobModel.query.filter_by(id=job_id).first()
+        if job is not None and job.status != "finished" and job.timestamp < time.time() - JOB_TIMEOUT:
+            self.update_job(
+                job_id,
+                status="finished",
+                result=json.dumps({"error": "The request was lost, please try again."}),
+                result_code=500,
+            )
+            job = ContainerJobModel.query.filter_by(id=job_id).first()
+        return job
+
+    def delete_old_jobs(self) -> None:
+        with self.app.app_context():
+            ContainerJobModel.query.filter(
+                ContainerJobModel.timestamp < int(time.time()) - JOB_RETENTION - JOB_TIMEOUT
+            ).delete(synchronize_session=False)
+            # Locks left behind by workers that died mid-job
+            ContainerSpawnLockModel.query.filter(
+                ContainerSpawnLockModel.timestamp < int(time.time()) - JOB_RETENTION - JOB_TIMEOUT
+            ).delete(synchronize_session=False)
+            ContainerEventModel.query.filter(
+                ContainerEventModel.timestamp < int(time.time()) - FEED_RETENTION
+            ).delete(synchronize_session=False)
+            db.session.commit()
+
+    def listen_events(self, docker_server: DockerServer, stop_event: threading.Event) -> None:
+        """
+        Follow a server's Docker events stream for the plugin's containers, keeping the state cache and the
+        database in sync. After a disconnect it subscribes again and resyncs from a full listing.
+        """
+        while not stop_event.is_set():
+            if not docker_server.healthy:
+                stop_event.wait(RECONNECT_BACKOFF_MIN)
+                continue
             try:
-                cpu_period = float(self.settings.get("container_maxcpu"))
-                if cpu_period > 0:
-                    kwargs["cpu_quota"] = int(cpu_period * 100000)
-                    kwargs["cpu_period"] = 100000
-            except ValueError:
-                ContainerException(
-                    "Configured container CPU limit must be a number")
+                docker_server.events = docker_server.client.events(
+                    decode=True, filters={"type": "container", "label": CONTAINER_LABEL, "event": CONTAINER_EVENTS})
+                # Subscribe before listing so that no event falls between the two
+                self.__resync_states(docker_server)
+                for event in docker_server.events:
+                    self.__handle_event(docker_server, event)
+            except Exception as e:
+                # Any failure here must not end the listener, it simply resubscribes
+                if not stop_event.is_set():
+                    logger.warning("Lost the Docker events stream of server %s: %s", docker_server.name, e)
+                    self.request_health_check()
+            finally:
+                docker_server.synced = False
+            stop_event.wait(RECONNECT_BACKOFF_MIN)
+
+    def __resync_states(self, docker_server: DockerServer) -> None:
+        previous = docker_server.states
+        containers = docker_server.client.containers.list(
+            all=True, sparse=True, filters={"label": CONTAINER_LABEL})
+        docker_server.states = {container.id: container.attrs.get("State") for container in containers}
+        docker_server.synced = True
+
+        # Containers that were running before the disconnect and are gone now died while we were not listening
+        for container_id, state in previous.items():
+            if state == "running" and docker_server.states.get(container_id) != "running":
+                self.__forget_container(docker_server, container_id)
+
+    def __handle_event(self, docker_server: DockerServer, event: dict) -> None:
+        action = event.get("Action") or event.get("status")
+        container_id = event.get("id") or event.get("Actor", {}).get("ID")
+        if container_id is None:
+            return
+
+        if action == "start":
+            docker_server.states[container_id] = "running"
+            self.feed.publish("status", container_id, running=True)
+        elif action == "die":
+            logger.debug("Container %s on server %s exited", container_id[:12], docker_server.name)
+            docker_server.states[container_id] = "exited"
+            self.__forget_container(docker_server, container_id)
+        elif action == "destroy":
+            now = time.monotonic()
+            docker_server.states[container_id] = "removed"
+            docker_server.removed[container_id] = now
+            while docker_server.removed:
+                oldest, removed_at = next(iter(docker_server.removed.items()))
+                if removed_at > now - REMOVED_STATE_TTL:
+                    break
+                del docker_server.removed[oldest]
+                if docker_server.states.get(oldest) == "removed":
+                    del docker_server.states[oldest]
+        elif action == "oom":
+            # A die event follows if the OOM killer took down the main process
+            with log_context(server=docker_server.name, container=container_id):
+                logger.warning("Container ran out of memory")
+
+    def __forget_container(self, docker_server: DockerServer, container_id: str) -> None:
+        # Every worker's listener sees the event, so each one tells only its own dashboards
+        self.feed.publish("status", container_id, running=False)
+        with self.app.app_context():
+            for model in CONTAINER_MODELS:
+                model.query.filter_by(container_id=container_id).delete(synchronize_session=False)
+            db.session.commit()
+        # Its row is gone, so the dashboards drop it as well
+        self.feed.publish("killed", container_id)
+        self.__release_port(container_id)
+
+    def is_state_current(self, server: str) -> bool:
+        """
+        Whether the events stream of a server is live, so the database has no rows left of its containers that died.
+        """
+        docker_server = self.servers.get(server)
+        return docker_server is not None and docker_server.healthy and docker_server.synced
+
+    def is_container_running(self, container_id: str, server: str = "") -> bool:
+        """
+        Answered from the event-fed state cache, falling back to asking the owning server only for containers
+        it does not know. Raises ContainerException rather than guessing when the owning server is down.
+        """
+        docker_server = self.servers.get(server)
+        for candidate in [docker_server] if docker_server is not None else list(self.servers.values()):
+            if candidate.synced and container_id in candidate.states:
+                return candidate.states[container_id] == "running"
+        return self.__query_container_running(container_id, server)
+
+    @run_command
+    def __query_container_running(self, container_id: str, server: str) -> bool:
+        owner = self.__get_owner_client(container_id, server)
+        if owner is None:
+            return False
+        with self.docker_latency.time(operation="status", server=owner[0]):
+            containers = owner[1].containers.list(all=True, sparse=True, filters={"id": container_id})
+        return any(container.attrs.get("State") == "running" for container in containers)
+
+    @run_command
+    def get_containers_status(self) -> "dict[str, str]":
+        """
+        Fetch the status of every container started by this plugin, from the events cache or with a single
+        list call per server.
+
+        :return: Dictionary mapping container ids to their Docker status (e.g. "running", "exited")
+        """
+        statuses = {}
+        for name, client in self.client.items():
+            docker_server = self.servers[name]
+            if docker_server.synced:
+                # Kept current by the events stream, no Docker call needed
+                statuses.update(docker_server.states)
+                continue
+            with self.docker_latency.time(operation="status", server=name):
+                containers = client.containers.list(
+                    all=True, sparse=True, filters={"label": CONTAINER_LABEL})
+            for container in containers:
+                statuses[container.id] = container.attrs.get("State")
+        return statuses
+
+    @run_command
+    def create_container(self, chal_id: str, team_id: str, user_id: str, image: str, port: int, command: str, volumes: str, server: str, verify_port: bool = False, resources: "ResourceProfile|None" = None) -> SpawnedContainer:
+        """
+        Start a container for a challenge. The published port is the one reserved by the port allocator, so no
+        extra Docker call is needed to read it back unless verify_port is set.
+
+        :param resources: Profile of the challenge, see get_resource_profile, or None for the global limits
+        """
+        if resources is None:
+            resources = self.get_resource_profile()
+        try:
+            server = self.select_server(server, image, resources)
+        except CapacityException:
+            self.spawn_failures.inc(server="", reason="capacity")
+            raise
+        client = self.client[server]
+        kwargs = self.get_resource_kwargs(resources)
 
         if volumes is not None and volumes != "":
-            print("Volumes:", volumes)
             try:
                 volumes_dict = json.loads(volumes)
                 kwargs["volumes"] = volumes_dict
             except json.decoder.JSONDecodeError:
                 raise ContainerException("Volumes JSON string is invalid")
 
-        external_port = random.randint(port, 65535)
-        while not self.__check_port__(external_port):
-            external_port = random.randint(port, 65535)
+        # Count this start against the server until it shows up in the database, so bursts spread out
+        docker_server = self.servers[server]
+        with docker_server.lock:
+            docker_server.pending += 1
+            docker_server.pending_memory += resources.memory
+            docker_server.pending_cpus += resources.cpus
+        try:
+            with log_context(challenge=chal_id, team=team_id or None, user=user_id or None, server=server):
+                return self.__run_container(client, server, chal_id, team_id, user_id, image, port, command, verify_port, kwargs)
+        finally:
+            with docker_server.lock:
+                docker_server.pending -= 1
+                docker_server.pending_memory -= resources.memory
+                docker_server.pending_cpus -= resources.cpus
 
-        print(f"Using {external_port} as the external port for challenge {chal_id} for team {team_id} spawned by {user_id}")
+    def get_resource_profile(self, challenge=None) -> ResourceProfile:
+        """
+        Resources of a challenge's containers. Memory and CPU limits the challenge leaves empty come from the
+        container_maxmemory and container_maxcpu settings.
+
+        :param challenge: ContainerChallengeModel or ChallengeSpec, or None for the global limits only
+        """
+        memory = getattr(challenge, "memory_limit", None)
+        cpus = getattr(challenge, "cpu_limit", None)
+        return ResourceProfile(
+            memory=max(memory, 0) if memory is not None else self.__get_number_setting("container_maxmemory"),
+            cpus=max(cpus, 0) if cpus is not None else self.__get_number_setting("container_maxcpu"),
+            pids=getattr(challenge, "pids_limit", None) or 0,
+            ulimits=self.parse_ulimits(getattr(challenge, "ulimits", None)),
+            tmpfs=self.parse_tmpfs(getattr(challenge, "tmpfs", None)),
+            storage=getattr(challenge, "storage_limit", None) or 0,
+        )
+
+    @staticmethod
+    def get_resource_kwargs(resources: ResourceProfile) -> dict:
+        """Arguments of containers.run() enforcing a resource profile."""
+        kwargs = {}
+        if resources.memory:
+            kwargs["mem_limit"] = f"{int(resources.memory)}m"
+        if resources.cpus:
+            kwargs["cpu_quota"] = int(resources.cpus * 100000)
+            kwargs["cpu_period"] = 100000
+        if resources.pids:
+            kwargs["pids_limit"] = int(resources.pids)
+        if resources.ulimits:
+            kwargs["ulimits"] = [docker.types.Ulimit(name=name, soft=soft, hard=hard)
+                for name, (soft, hard) in resources.ulimits.items()]
+        if resources.tmpfs:
+            kwargs["tmpfs"] = dict(resources.tmpfs)
+        if resources.storage:
+            # Needs a storage driver with quota support, e.g. overlay2 on xfs with pquota
+            kwargs["storage_opt"] = {"size": f"{int(resources.storage)}M"}
+        return kwargs
+
+    @staticmethod
+    def parse_ulimits(value: "str|None") -> "dict[str, tuple[int, int]]":
+        """
+        Parse a challenge's ulimits, a JSON object of limit names to a number (soft and hard) or a
+        [soft, hard] pair, e.g. {"nofile": [1024, 2048], "nproc": 256}. Raises ContainerException when malformed.
+        """
+        if not value:
+            return {}
         try:
-            return client.containers.run(
-                image,
-                ports={str(port): str(external_port)},
-                command=command,
-                detach=True,
-                auto_remove=True,
-                environment={"CHALLENGE_ID": chal_id, "TEAM_ID": team_id, "USER_ID": user_id},
-                **kwargs
-            )
-        except docker.errors.ImageNotFound:
-            raise ContainerException("Docker image not found")
+            ulimits = json.loads(value)
+        except json.decoder.JSONDecodeError:
+            raise ContainerException("Ulimits must be valid JSON")
+        if not isinstance(ulimits, dict):
+            raise ContainerException("Ulimits must be a JSON object of limit names to limits")
 
-    @run_command
-    def get_container_port(self, container_id: str,server: str) -> "str|None":
-        for name,client_name in self.client.items():
-            print(f"Client in port: {client_name}")
-            print(f"Server in port: {name}")           
-            if server==name:
-                client = client_name  
-                print(f"client in port: {client}")             
+        parsed = {}
+        for name, limit in ulimits.items():
+            if isinstance(limit, list) and len(limit) == 2:
+                soft, hard = limit
+            else:
+                soft = hard = limit
+            if any(isinstance(part, bool) or not isinstance(part, int) for part in (soft, hard)) or soft > hard:
+                raise ContainerException(f"Ulimit {name} must be an integer or a [soft, hard] pair of integers")
+            parsed[name] = (soft, hard)
+        return parsed
+
+    @staticmethod
+    def parse_tmpfs(value: "str|None") -> "dict[str, str]":
+        """
+        Parse a challenge's tmpfs mounts, a JSON object of container paths to mount options,
+        e.g. {"/tmp": "size=64m,mode=1777"}. Raises ContainerException when malformed.
+        """
+        if not value:
+            return {}
+        try:
+            tmpfs = json.loads(value)
+        except json.decoder.JSONDecodeError:
+            raise ContainerException("Tmpfs mounts must be valid JSON")
+        if not isinstance(tmpfs, dict) or not all(
+                isinstance(path, str) and path.startswith("/") and isinstance(options, str)
+                for path, options in tmpfs.items()):
+            raise ContainerException("Tmpfs mounts must be a JSON object of absolute paths to mount options")
+        return tmpfs
+
+    def __run_container(self, client, server, chal_id, team_id, user_id, image, port, command, verify_port, kwargs) -> SpawnedContainer:
+        allocator = self.get_port_allocator(server)
+        for attempt in range(PORT_ALLOCATION_ATTEMPTS):
+            external_port = allocator.reserve()
+            if external_port is None:
+                # Ports released by other workers only show up after a reseed
+                self.seed_ports(server)
+                external_port = allocator.reserve()
+            if external_port is None:
+                self.spawn_failures.inc(server=server, reason="no_ports")
+                raise ContainerException("No free ports left on the Docker server")
+
+            logger.debug("Starting %s with host port %d", image, external_port)
+            try:
+                # Bound concurrent starts per server so one slow host cannot hold every job worker
+                with self.servers[server].spawn_slots, self.docker_latency.time(operation="create", server=server):
+                    container = client.containers.run(
+                        image,
+                        ports={str(port): str(external_port)},
+                        command=command,
+                        detach=True,
+                        auto_remove=True,
+                        environment={"CHALLENGE_ID": chal_id, "TEAM_ID": team_id, "USER_ID": user_id},
+                        labels={
+                            CONTAINER_LABEL: "true",
+                            f"{CONTAINER_LABEL}.challenge_id": str(chal_id),
+                            f"{CONTAINER_LABEL}.team_id": str(team_id),
+                            f"{CONTAINER_LABEL}.user_id": str(user_id),
+                        },
+                        **kwargs
+                    )
+            except docker.errors.ImageNotFound:
+                allocator.release(external_port)
+                self.spawn_failures.inc(server=server, reason="image_not_found")
+                raise ContainerException("Docker image not found")
+            except docker.errors.APIError as e:
+                if "port is already allocated" in str(e) or "address already in use" in str(e):
+                    # Taken by another worker or a process on the host, try the next free port
+                    logger.debug("Host port %d is already taken, trying another one", external_port)
+                    allocator.mark_used(external_port)
+                    continue
+                allocator.release(external_port)
+                self.docker_errors.inc(operation="create", server=server)
+                self.spawn_failures.inc(server=server, reason="docker_error")
+                raise
+            except BaseException as e:
+                allocator.release(external_port)
+                if isinstance(e, CONNECTION_ERRORS):
+                    self.docker_errors.inc(operation="create", server=server)
+                    self.spawn_failures.inc(server=server, reason="docker_error")
+                raise
+
+            self.containers_created.inc(server=server)
+            with log_context(container=container.id):
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("Started container on host port %d", external_port)
+                else:
+                    log_sampled(logging.INFO, SPAWN_LOG_SAMPLE_RATE, "Started container on host port %d", external_port)
+            allocator.confirm(external_port)
+            self.container_ports[container.id] = (server, external_port)
+            # The events listener may already have seen a container that exited right away, keep what it recorded
+            self.servers[server].states.setdefault(container.id, "running")
+
+            published_port = external_port
+            if verify_port:
+                container.reload()
+                published_port = None
+                for mappings in container.ports.values():
+                    if mappings:
+                        published_port = int(mappings[0]["HostPort"])
+                        break
+            return SpawnedContainer(container.id, published_port, server)
+
+        raise ContainerException("Could not find a free port on the Docker server")
+
+    def get_eligible_servers(self, server_spec: str) -> "list[str]":
+        """
+        Healthy servers a challenge may be placed on. An empty spec or "*" means any server, otherwise the spec
+        is a comma separated list of server names.
+        """
+        if not self.client:
+            return []
+        if server_spec is None or server_spec.strip() in ("", ANY_SERVER):
+            return list(self.client.keys())
+        return [name.strip() for name in server_spec.split(",") if name.strip() in self.client]
+
+    def is_eligible_server(self, server_spec: str, server: str) -> bool:
+        if server_spec is None or server_spec.strip() in ("", ANY_SERVER):
+            return server in self.servers
+        return server in [name.strip() for name in server_spec.split(",")]
+
+    def select_server(self, server_spec: str, image: str, resources: "ResourceProfile|None" = None) -> str:
+        """
+        Pick the least loaded eligible server for a new container. Servers that already have the image come
+        first, then the one with the lowest memory or CPU commitment (the resource profiles of its containers
+        against the server's totals), then the one with the fewest containers.
+        """
+        if resources is None:
+            resources = self.get_resource_profile()
+        candidates = self.get_eligible_servers(server_spec)
+        if not candidates:
+            raise ContainerException("No Docker server is available for this challenge")
+
+        usage = self.get_server_usage()
+        admitted = [name for name in candidates if self.has_capacity(name, usage, resources)]
+        if not admitted:
+            raise CapacityException(self.estimate_retry_after(candidates))
+        candidates = admitted
+        if len(candidates) == 1:
+            return candidates[0]
+
+        def load(name):
+            docker_server = self.servers[name]
+            committed = self.get_committed(name, usage, resources)
+            commitment = 0
+            if docker_server.memory:
+                commitment = max(commitment, committed["memory"] * 1024 * 1024 / docker_server.memory)
+            if docker_server.cpus:
+                commitment = max(commitment, committed["cpus"] / docker_server.cpus)
+            return (not self.has_image(name, image), commitment, committed["containers"])
+
+        return min(candidates, key=load)
+
+    @staticmethod
+    def parse_server_limits(value: "str|None") -> "dict[str, dict[str, float]]":
+        """
+        Parse the docker_server_limits setting, a JSON object mapping server names (or "*" for every server
+        without an entry) to limits, e.g. {"*": {"containers": 200, "memory": 16384, "cpus": 12}}.
+        Raises ContainerException when the value is malformed.
+        """
+        if not value:
+            return {}
+        try:
+            limits = json.loads(value)
+        except json.decoder.JSONDecodeError:
+            raise ContainerException("Server limits must be valid JSON")
+        if not isinstance(limits, dict):
+            raise ContainerException("Server limits must be a JSON object of server names to limits")
+
+        parsed = {}
+        for server, server_limits in limits.items():
+            if not isinstance(server_limits, dict):
+                raise ContainerException(f"Limits of server {server} must be a JSON object")
+            parsed[server] = {}
+            for key, limit in server_limits.items():
+                if key not in SERVER_LIMIT_KEYS:
+                    raise ContainerException(f"Unknown limit {key} for server {server}, expected one of {', '.join(SERVER_LIMIT_KEYS)}")
+                if isinstance(limit, bool) or not isinstance(limit, (int, float)) or limit < 0:
+                    raise ContainerException(f"Limit {key} of server {server} must be a non-negative number")
+                parsed[server][key] = limit
+        return parsed
+
+    def get_server_limits(self, server: str) -> "dict[str, float]":
+        return self.server_limits.get(server, self.server_limits.get(ANY_SERVER, {}))
+
+    def get_committed(self, server: str, usage: "dict[str, dict[str, float]]",
+            resources: ResourceProfile) -> "dict[str, float]":
+        """Containers, memory (MB) and CPUs a server would be committed to with one more container of this profile."""
+        docker_server = self.servers[server]
+        used = usage.get(server, {})
+        return {
+            "containers": used.get("containers", 0) + docker_server.pending + 1,
+            "memory": used.get("memory", 0) + docker_server.pending_memory + resources.memory,
+            "cpus": used.get("cpus", 0) + docker_server.pending_cpus + resources.cpus,
+        }
+
+    def has_capacity(self, server: str, usage: "dict[str, dict[str, float]]", resources: ResourceProfile) -> bool:
+        """Whether one more container of this profile fits on a server within its configured limits."""
+        limits = self.get_server_limits(server)
+        if not limits:
+            return True
+        committed = self.get_committed(server, usage, resources)
+        return all(committed[key] <= limit for key, limit in limits.items())
+
+    def estimate_retry_after(self, servers: "list[str]") -> int:
+        """Seconds until the next container on these servers expires, which frees a slot."""
+        next_expiry = db.session.query(db.func.min(ContainerInfoModel.expires)).filter(
+            ContainerInfoModel.server.in_(servers)).scalar()
+        if next_expiry is None:
+            return CAPACITY_RETRY_MIN
+        return int(min(max(next_expiry - time.time(), CAPACITY_RETRY_MIN), CAPACITY_RETRY_MAX))
+
+    def get_capacity_overview(self) -> dict:
+        """Usage against the configured limits of every server, and the number of spawn requests in flight."""
+        usage = self.get_server_usage()
+        servers = {}
+        for name, docker_server in self.servers.items():
+            used = usage.get(name, {})
+            servers[name] = {
+                "healthy": docker_server.healthy,
+                "containers": used.get("containers", 0),
+                "memory": used.get("memory", 0),
+                "cpus": used.get("cpus", 0),
+                "pending": docker_server.pending,
+                "limits": self.get_server_limits(name),
+            }
+        queued = ContainerJobModel.query.filter(
+            ContainerJobModel.kind == "spawn",
+            ContainerJobModel.status != "finished",
+            ContainerJobModel.timestamp >= int(time.time()) - JOB_TIMEOUT,
+        ).count()
+        return {"servers": servers, "queued": queued}
+
+    def get_server_usage(self) -> "dict[str, dict[str, float]]":
+        """
+        Containers (team containers, idle warm pool ones and shared replicas) recorded on each server, with the
+        memory (MB) and CPUs reserved for them by their challenges' resource profiles.
+        """
+        default_memory = self.__get_number_setting("container_maxmemory")
+        default_cpus = self.__get_number_setting("container_maxcpu")
+        usage = {}
+        for model in (ContainerInfoModel, ContainerPoolModel, ContainerReplicaModel):
+            rows = db.session.query(
+                model.server,
+                db.func.count(model.container_id),
+                db.func.sum(db.func.coalesce(ContainerChallengeModel.memory_limit, default_memory)),
+                db.func.sum(db.func.coalesce(ContainerChallengeModel.cpu_limit, default_cpus)),
+            ).outerjoin(ContainerChallengeModel, ContainerChallengeModel.id == model.challenge_id) \
+                .group_by(model.server)
+            for server, count, memory, cpus in rows:
+                used = usage.setdefault(server, {"containers": 0, "memory": 0, "cpus": 0})
+                used["containers"] += count
+                used["memory"] += float(memory or 0)
+                used["cpus"] += float(cpus or 0)
+        return usage
+
+    def has_image(self, server: str, image: str) -> bool:
+        return normalize_image_tag(image) in self.get_image_inventory().get(server, set())
+
+    def __get_number_setting(self, key: str) -> float:
+        try:
+            return max(float(self.settings.get(key) or 0), 0)
+        except ValueError:
+            return 0
+
+    def get_port_allocator(self, server: str) -> PortAllocator:
+        docker_server = self.servers[server]
+        with self.port_lock:
+            if docker_server.ports is None:
+                start, end = DEFAULT_PORT_RANGE
                 try:
-                    for port in list(client.containers.get(container_id).ports.values()):
-                        if port is not None:
-                            return port[0]["HostPort"]
-                except (KeyError, IndexError):
-                    return None
+                    start, end = [int(port) for port in self.settings.get("container_port_range").split("-")]
+                except (AttributeError, ValueError):
+                    pass
+                docker_server.ports = PortAllocator(start, end)
+                self.seed_ports(server)
+        return docker_server.ports
+
+    def seed_ports(self, server: str) -> None:
+        """Rebuild a server's free port list from the ports published by its live containers and the database."""
+        used_ports = set()
+        for container in self.client[server].containers.list(sparse=True):
+            for mapping in container.attrs.get("Ports") or []:
+                if mapping.get("PublicPort"):
+                    used_ports.add(int(mapping["PublicPort"]))
+
+        for model in (ContainerInfoModel, ContainerPoolModel, ContainerReplicaModel):
+            for row in db.session.query(model.port).filter(model.server == server):
+                if row.port:
+                    used_ports.add(int(row.port))
+
+        self.servers[server].ports.seed(used_ports)
 
     
     def get_images(self) -> "list[str]|None":
-#        if self.images_list is not None and len(self.images_list) > 0 and len(self.images_list) == self.len_images_list:
-#               return self.images_list
-        images_list = []
-        server = json.loads(self.settings.get("docker_servers","{}"))        
-        for name,server_url in server.items(): 
-            print(f"Connecting to Docker server: {server_url}")
-            client = docker.DockerClient(base_url=server_url)
+        images = set()
+        for tags in self.get_image_inventory().values():
+            images.update(tags)
+        return sorted(images)
+
+    def get_image_servers(self) -> "dict[str, list[str]]":
+        """Map of image tag to the servers that have it."""
+        image_servers = {}
+        for server, tags in self.get_image_inventory().items():
+            for tag in tags:
+                image_servers.setdefault(tag, []).append(server)
+        return image_servers
+
+    def get_image_inventory(self, refresh: bool = False) -> "dict[str, set[str]]":
+        """
+        Image tags available on each healthy server. All servers are listed in parallel and the result is cached
+        for IMAGE_INVENTORY_TTL seconds, or until the settings change. Once loaded, an expired copy keeps being
+        served while a background thread lists the servers again, so spawns never wait on a slow daemon.
+        """
+        if not refresh:
+            with self.image_lock:
+                loaded = self.image_inventory_expires > 0
+                if loaded and self.image_inventory_expires <= time.time() and not self.image_refreshing:
+                    self.image_refreshing = True
+                    threading.Thread(target=self.__refresh_image_inventory, name="image-inventory", daemon=True).start()
+                if loaded:
+                    return self.image_inventory
+        return self.__load_image_inventory(refresh)
+
+    def __refresh_image_inventory(self) -> None:
+        try:
+            self.__load_image_inventory(True)
+        except Exception:
+            logger.exception("Failed to refresh the image inventory")
+        finally:
+            with self.image_lock:
+                self.image_refreshing = False
+
+    def __load_image_inventory(self, refresh: bool) -> "dict[str, set[str]]":
+        # Only one thread lists the servers at a time, the others wait for its result
+        with self.image_refresh_lock:
+            if not refresh and self.image_inventory_expires > time.time():
+                return self.image_inventory
+
+            clients = dict(self.client or {})
+
+            def list_tags(name):
+                try:
+                    return name, {tag for image in clients[name].images.list() for tag in image.tags}
+                except CONNECTION_ERRORS as e:
+                    logger.warning("Failed to list images on Docker server %s: %s", name, e)
+                    return name, None
+
+            inventory = {}
+            if clients:
+                with ThreadPoolExecutor(max_workers=len(clients)) as executor:
+                    for name, tags in executor.map(list_tags, clients):
+                        if tags is not None:
+                            inventory[name] = tags
+
+            with self.image_lock:
+                self.image_inventory = inventory
+                self.image_inventory_expires = time.time() + IMAGE_INVENTORY_TTL
+            return inventory
+
+    def warm_up_images(self, job_id: str = None) -> dict:
+        """
+        Pull every container challenge image onto each eligible server that does not have it yet, in parallel,
+        so that the first spawn of a challenge on a host never waits for a pull.
+
+        :param job_id: Job whose result is updated with the progress after every pull
+        :return: Progress dictionary with the total, pulled and failed counts and the state of every pull
+        """
+        inventory = self.get_image_inventory(refresh=True)
+        pulls = set()
+        for challenge in ContainerChallengeModel.query.all():
+            if not challenge.image:
+                continue
+            image = normalize_image_tag(challenge.image)
+            for server in self.get_eligible_servers(challenge.server):
+                if image not in inventory.get(server, set()):
+                    pulls.add((server, image))
+
+        progress = {
+            "status": "running",
+            "total": len(pulls),
+            "pulled": 0,
+            "failed": 0,
+            "pulls": {f"{server}: {image}": "pending" for server, image in pulls},
+        }
+        progress_lock = threading.Lock()
+
+        def pull(task):
+            server, image = task
+            repository, tag = docker.utils.parse_repository_tag(image)
             try:
-                client.ping()
-                print(f"Connected to Docker server: {server_url}")
-                images = client.images.list()
-                print(f"Images found on {server_url}: {images}")
-                for image in images:
-                    if len(image.tags) > 0:
-                        images_list.append(image.tags[0])
-            except docker.errors.DockerException as e:
-                print(f"Failed to connect to Docker server: {server_url} - {e}")
-                continue    
-
-        return images_list
-
-
-    def kill_container(self, container_id: str):
-        for client in self.client.values():
+                self.client[server].images.pull(repository, tag=tag)
+                state = "pulled"
+            except (KeyError, *CONNECTION_ERRORS) as e:
+                logger.warning("Image warmup could not pull %s on %s: %s", image, server, e)
+                state = f"failed: {e}"
+
+            with progress_lock:
+                progress["pulls"][f"{server}: {image}"] = state
+                progress["pulled" if state == "pulled" else "failed"] += 1
+                if job_id is not None:
+                    with self.app.app_context():
+                        self.update_job(job_id, result=json.dumps(progress))
+
+        if pulls:
+            with ThreadPoolExecutor(max_workers=WARMUP_WORKERS) as executor:
+                list(executor.map(pull, sorted(pulls)))
+            self.get_image_inventory(refresh=True)
+
+        progress["status"] = "finished"
+        return progress
+
+    def kill_container(self, container_id: str, server: str = "") -> dict:
+        return self.kill_containers({container_id: server})[container_id]
+
+    @run_command
+    def kill_containers(self, containers: "dict[str, str]", reason: "str|None" = "killed") -> "dict[str, dict]":
+        """
+        Kill many containers at once. They are grouped by server and killed concurrently with a bounded
+        pool per server, then the rows of every container that is gone are deleted in bulk. Must be called
+        inside an app context.
+
+        :param containers: Container id mapped to the name of its server, or "" when unknown
+        :param reason: Kind of the dashboard event recorded for every container that is gone, None for no event
+        :return: Container id mapped to {"success": ...} or {"error": ...}
+        """
+        by_server = {}
+        results = {}
+        for container_id, server in containers.items():
+            if server in self.servers and server not in self.client:
+                # Keep the row, the container is still there once the server comes back
+                results[container_id] = {"error": f"Docker server {server} is not reachable"}
+                continue
+            # Containers whose server is unknown are looked up on every connected one
+            by_server.setdefault(server if server in self.client else None, []).append(container_id)
+
+        executors = []
+        futures = {}
+        try:
+            for server, container_ids in by_server.items():
+                executor = ThreadPoolExecutor(max_workers=KILL_WORKERS_PER_SERVER)
+                executors.append(executor)
+                for container_id in container_ids:
+                    futures[container_id] = executor.submit(self.__kill_one, container_id, server)
+            results.update({container_id: future.result() for container_id, future in futures.items()})
+        finally:
+            for executor in executors:
+                executor.shutdown(wait=False)
+
+        gone_ids = [container_id for container_id, result in results.items() if "success" in result]
+        for start in range(0, len(gone_ids), KILL_BATCH_SIZE):
+            batch = gone_ids[start:start + KILL_BATCH_SIZE]
+            for model in CONTAINER_MODELS:
+                model.query.filter(model.container_id.in_(batch)).delete(synchronize_session=False)
+        if reason is not None:
+            self.feed.record(reason, gone_ids)
+        db.session.commit()
+        return results
+
+    def __kill_one(self, container_id: str, server: "str|None") -> dict:
+        if server is None:
+            server = self.find_container_server(container_id)
+        if server is not None:
             try:
-                client.containers.get(container_id).kill()
+                with self.docker_latency.time(operation="kill", server=server):
+                    self.client[server].containers.get(container_id).kill()
             except docker.errors.NotFound:
                 pass
+            except docker.errors.APIError as e:
+                # 409 means the container exists but is no longer running, which is what we want
+                if e.status_code != 409:
+                    self.docker_errors.inc(operation="kill", server=server)
+                    return {"error": f"Could not kill container {container_id}: {e}"}
+            except (KeyError, *CONNECTION_ERRORS) as e:
+                self.docker_errors.inc(operation="kill", server=server)
+                self.request_health_check()
+                return {"error": f"Could not kill container {container_id}: {e}"}
+        self.__release_port(container_id)
+        return {"success": "Container killed"}
+
+    def find_container_server(self, container_id: str) -> "str|None":
+        """
+        Find which server runs a container whose record does not name one, asking every connected server at once.
+
+        :return: Name of the server, or None if no connected server has the container
+        """
+        for name, docker_server in list(self.servers.items()):
+            if docker_server.synced and container_id in docker_server.states:
+                return name
+
+        clients = dict(self.client or {})
+        if not clients:
+            return None
+
+        def lookup(name):
+            try:
+                return len(clients[name].containers.list(all=True, sparse=True, filters={"id": container_id})) > 0
+            except CONNECTION_ERRORS:
+                self.request_health_check()
+                return False
+
+        with ThreadPoolExecutor(max_workers=len(clients)) as executor:
+            for name, found in zip(clients, executor.map(lookup, clients)):
+                if found:
+                    return name
+        return None
+
+    def __get_owner_client(self, container_id: str, server: str) -> "tuple[str, docker.DockerClient]|None":
+        """Client of the server that owns a container, found by fan-out when the server is unknown."""
+        if server not in self.servers:
+            server = self.find_container_server(container_id)
+            if server is None:
+                return None
+        client = self.client.get(server)
+        if client is None:
+            raise ContainerException(f"Docker server {server} is not reachable")
+        return server, client
+
+    def __release_port(self, container_id: str) -> None:
+        server, port = self.container_ports.pop(container_id, (None, None))
+        docker_server = self.servers.get(server)
+        if docker_server is not None and docker_server.ports is not None:
+            docker_server.ports.release(port)
 
     def is_connected(self) -> bool:
-        if self.client is None:
-            return False
-        try:
-            for client in self.client.values():
-                client.ping()
-            return True
-        except docker.errors.APIError:
+        if not self.servers:
             return False
+        return all(server.healthy for server in self.servers.values())
 
-    def get_docker_client(self,challenge=None) -> docker.DockerClient:
-        print(f"Clients: {self.client}")
-        if self.client is None:
-            raise ContainerException("Docker is not connected")
-        return random.choice(list(self.client.values()))
+    def get_server_hostname(self, server: str) -> str:
+        """Hostname players use to reach containers on a server: the SSH/TCP host, or docker_hostname for local sockets."""
+        hostname = self.server_hostnames.get(server)
+        if hostname is None:
+            return self.settings.get("docker_hostname", "")
+        return hostname
+
+    def __resolve_hostname(self, server_url: str) -> str:
+        if server_url.startswith("unix://") or urlparse(server_url).hostname is None:
+            return self.settings.get("docker_hostname", "")
+        return urlparse(server_url).hostname
 
     def get_running_servers(self) -> "list[str]":
         if self.client is None:
@@ -0,0 +1,120 @@
+import json
+import threading
+import time
+from collections import deque
+
+from CTFd.models import db
+from .models import ContainerEventModel
+from .log import logger
+
+# Seconds between two reads of the event log by the poller of a process
+FEED_POLL_INTERVAL = 1
+# Seconds of the event log re-read on every poll, so events committed out of id order are not skipped
+FEED_LOOKBACK = 10
+# Seconds an event is kept in the database, much longer than any poller lags behind
+FEED_RETENTION = 300
+# Events kept in memory per process; a subscriber that falls further behind is told to reload
+FEED_BUFFER_SIZE = 1000
+
+
+class ContainerFeed:
+    """
+    Stream of container changes for the admin dashboard. Changes made by any CTFd worker are written to
+    ContainerEventModel in the transaction that makes them, and one poller thread per process reads that
+    log and hands every event to all subscribers of the process, so open dashboards share a single query.
+    Docker status changes are seen by the events listener of every worker and are published locally only.
+    """
+    def __init__(self, app):
+        self.app = app
+        self.condition = threading.Condition()
+        self.events = deque(maxlen=FEED_BUFFER_SIZE)
+        self.sequence = 0
+        self.subscribers = 0
+        self.poller = None
+
+    def record(self, kind: str, container_ids: "list[str]", **data) -> None:
+        """
+        Add one event per container to the current session. They reach subscribers once the caller commits.
+
+        :param kind: One of "created", "renewed", "killed" or "expired"
+        :param data: JSON serializable fields sent along with every event
+        """
+        now = int(time.time())
+        payload = json.dumps(data) if data else None
+        db.session.add_all([
+            ContainerEventModel(kind=kind, container_id=container_id, data=payload, timestamp=now)
+            for container_id in container_ids])
+
+    def publish(self, kind: str, container_id: str, **data) -> None:
+        """Hand an event to the subscribers of this process only."""
+        with self.condition:
+            self.sequence += 1
+            self.events.append((self.sequence, {"type": kind, "id": container_id, **data}))
+            self.condition.notify_all()
+
+    def subscribe(self, timeout: float):
+        """
+        Generator of the events published after the call. Yields None after timeout seconds without events,
+        so the caller can send a keep-alive, and a single reset event when events were dropped before it
+        could read them.
+        """
+        with self.condition:
+            self.subscribers += 1
+            cursor = self.sequence
+            if self.poller is None:
+                self.poller = threading.Thread(target=self.__poll, name="container-feed", daemon=True)
+                self.poller.start()
+        try:
+            while True:
+                with self.condition:
+                    if self.sequence == cursor:
+                        self.condition.wait(timeout)
+                    missed = bool(self.events) and self.events[0][0] > cursor + 1
+                    pending = [event for sequence, event in self.events if sequence > cursor]
+                    cursor = self.sequence
+                if missed:
+                    yield {"type": "reset"}
+                elif not pending:
+                    yield None
+                else:
+                    yield from pending
+        finally:
+            with self.condition:
+                self.subscribers -= 1
+
+    def __poll(self) -> None:
+        # Event ids already handed out, with their timestamp so they can be forgotten once out of the lookback
+        seen = {}
+        try:
+            with self.app.app_context():
+                for event_id, timestamp in db.session.query(ContainerEventModel.id, ContainerEventModel.timestamp) \
+                        .filter(ContainerEventModel.timestamp >= int(time.time()) - FEED_LOOKBACK):
+                    seen[event_id] = timestamp
+        except Exception as e:
+            logger.warning("Could not read the container event log: %s", e)
+
+        while True:
+            with self.condition:
+                if self.subscribers == 0:
+                    # Checked under the lock, so a new subscriber either sees this thread or starts another
+                    self.poller = None
+                    return
+            time.sleep(FEED_POLL_INTERVAL)
+
+            since = int(time.time()) - FEED_LOOKBACK
+            try:
+                with self.app.app_context():
+                    rows = db.session.query(
+                        ContainerEventModel.id, ContainerEventModel.kind, ContainerEventModel.container_id,
+                        ContainerEventModel.data, ContainerEventModel.timestamp,
+                    ).filter(ContainerEventModel.timestamp >= since).order_by(ContainerEventModel.id).all()
+            except Exception as e:
+                logger.warning("Could not read the container event log: %s", e)
+                continue
+
+            for event_id, kind, container_id, data, timestamp in rows:
+                if event_id in seen:
+                    continue
+                seen[event_id] = timestamp
+                self.publish(kind, container_id, **(json.loads(data) if data else {}))
+            seen = {event_id: timestamp for event_id, timestamp in seen.items() if timestamp >= since}
@@ -0,0 +1,65 @@
+import contextvars
+import logging
+import os
+import random
+from contextlib import contextmanager
+
+# Context fields in the order they are printed
+CONTEXT_FIELDS = ("job", "challenge", "team", "user", "server", "container")
+
+logger = logging.getLogger("ctfd.plugins.containers")
+
+_context = contextvars.ContextVar("container_log_context", default={})
+
+
+@contextmanager
+def log_context(**fields):
+    """
+    Attach correlation fields (challenge, team, user, server, container, job) to every record logged inside
+    the with block by this thread. Nested blocks add to the outer fields. Worker threads start with an empty
+    context, so code running on a pool sets its own.
+    """
+    token = _context.set({**_context.get(), **{key: value for key, value in fields.items() if value is not None}})
+    try:
+        yield
+    finally:
+        _context.reset(token)
+
+
+def log_sampled(level: int, rate: float, msg: str, *args) -> None:
+    """Log only a fraction of a chatty message, e.g. one per container start. Free when the level is disabled."""
+    if logger.isEnabledFor(level) and random.random() < rate:
+        logger.log(level, msg, *args, extra={"sample_rate": rate})
+
+
+class ContextFilter(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        context = _context.get()
+        fields = []
+        for key in CONTEXT_FIELDS:
+            if key in context:
+                value = str(context[key])
+                # Full Docker ids are 64 characters, the short form is what docker ps shows
+                fields.append(f"{key}={value[:12] if key == 'container' else value}")
+        if getattr(record, "sample_rate", None) is not None:
+            fields.append(f"sample_rate={record.sample_rate}")
+        record.context = " [" + " ".join(fields) + "]" if fields else ""
+        return True
+
+
+def setup_logging() -> None:
+    """
+    Give the plugin logger its own handler with the correlation fields, once per process. The level comes from
+    the CTFD_CONTAINERS_LOG_LEVEL environment variable and defaults to INFO.
+    """
+    if logger.handlers:
+        return
+    handler = logging.StreamHandler()
+    handler.addFilter(ContextFilter())
+    handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s%(context)s"))
+    logger.addHandler(handler)
+    try:
+        logger.setLevel(os.environ.get("CTFD_CONTAINERS_LOG_LEVEL", "INFO").upper())
+    except ValueError:
+        logger.setLevel(logging.INFO)
+    logger.propagate = False
@@ -0,0 +1,137 @@
+import threading
+import time
+from contextlib import contextmanager
+
+# Upper bounds in seconds of the latency histogram buckets, Docker calls range from milliseconds to minutes
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+def format_labels(label_names: "tuple[str, ...]", label_values: "tuple[str, ...]", extra: str = "") -> str:
+    pairs = [f'{name}="{escape_label(value)}"' for name, value in zip(label_names, label_values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, label_names: "tuple[str, ...]" = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def label_key(self, labels: dict) -> "tuple[str, ...]":
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def render(self) -> "list[str]":
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        with self.lock:
+            for key, value in sorted(self.values.items()):
+                lines.append(f"{self.name}{format_labels(self.label_names, key)} {format_value(value)}")
+        return lines
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self.label_key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        key = self.label_key(labels)
+        with self.lock:
+            self.values[key] = value
+
+    def replace(self, values: "dict[tuple[str, ...], float]") -> None:
+        """Swap in a complete set of values, so label sets that disappeared are no longer reported."""
+        with self.lock:
+            self.values = {tuple(str(part) for part in key): value for key, value in values.items()}
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, label_names: "tuple[str, ...]" = (),
+                 buckets: "tuple[float, ...]" = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels) -> None:
+        key = self.label_key(labels)
+        with self.lock:
+            buckets, total, count = self.values.get(key, ([0] * len(self.buckets), 0.0, 0))
+            # Buckets are cumulative, a value counts towards every bucket whose bound it fits under
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    buckets[index] += 1
+            self.values[key] = (buckets, total + value, count + 1)
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of the with block, including blocks that raise."""
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - start, **labels)
+
+    def render(self) -> "list[str]":
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        with self.lock:
+            for key, (buckets, total, count) in sorted(self.values.items()):
+                for bound, bucket_count in list(zip(self.buckets, buckets)) + [(float("inf"), count)]:
+                    bucket_label = 'le="%s"' % format_value(bound)
+                    lines.append(f"{self.name}_bucket{format_labels(self.label_names, key, bucket_label)} {bucket_count}")
+                lines.append(f"{self.name}_sum{format_labels(self.label_names, key)} {format_value(total)}")
+                lines.append(f"{self.name}_count{format_labels(self.label_names, key)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Minimal in-process metrics registry rendering the Prometheus text exposition format, so the plugin
+    needs no extra dependency. Values are per CTFd worker process.
+    """
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, documentation: str, label_names: "tuple[str, ...]" = ()) -> Counter:
+        return self.register(Counter(name, documentation, label_names))
+
+    def gauge(self, name: str, documentation: str, label_names: "tuple[str, ...]" = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, label_names))
+
+    def histogram(self, name: str, documentation: str, label_names: "tuple[str, ...]" = (),
+                  buckets: "tuple[float, ...]" = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, label_names, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,31 @@
+"""Add index on container expiry
+
+Revision ID: 3f1c2a9b7d10
+Revises:
+Create Date: 2026-10-18 10:00:00.000000
+
+"""
+import sqlalchemy as sa
+
+from CTFd.plugins.migrations import get_all_tables
+
+# revision identifiers, used by Alembic.
+revision = "3f1c2a9b7d10"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade(op=None):
+    if "container_info_model" not in get_all_tables(op=op):
+        return
+
+    indexes = sa.inspect(op.get_bind()).get_indexes("container_info_model")
+    if "ix_container_info_model_expires" not in [index["name"] for index in indexes]:
+        op.create_index(
+            "ix_container_info_model_expires", "container_info_model", ["expires"]
+        )
+
+
+def downgrade(op=None):
+    op.drop_index("ix_container_info_model_expires", table_name="container_info_model")
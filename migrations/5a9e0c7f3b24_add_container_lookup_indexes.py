@@ -0,0 +1,38 @@
+"""Add owner, challenge and server indexes on containers
+
+Revision ID: 5a9e0c7f3b24
+Revises: 8c4e6d21a5f3
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+import sqlalchemy as sa
+
+from CTFd.plugins.migrations import get_all_tables
+
+# revision identifiers, used by Alembic.
+revision = "5a9e0c7f3b24"
+down_revision = "8c4e6d21a5f3"
+branch_labels = None
+depends_on = None
+
+INDEXES = [
+    ("ix_container_info_model_user_challenge", ["user_id", "challenge_id"], {}),
+    ("ix_container_info_model_team_challenge", ["team_id", "challenge_id"], {}),
+    ("ix_container_info_model_server", ["server"], {"mysql_length": 255}),
+]
+
+
+def upgrade(op=None):
+    if "container_info_model" not in get_all_tables(op=op):
+        return
+
+    indexes = sa.inspect(op.get_bind()).get_indexes("container_info_model")
+    existing = [index["name"] for index in indexes]
+    for name, columns, kwargs in INDEXES:
+        if name not in existing:
+            op.create_index(name, "container_info_model", columns, **kwargs)
+
+
+def downgrade(op=None):
+    for name, _, _ in INDEXES:
+        op.drop_index(name, table_name="container_info_model")
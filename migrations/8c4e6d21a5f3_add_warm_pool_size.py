@@ -0,0 +1,34 @@
+"""Add warm pool size to container challenges
+
+Revision ID: 8c4e6d21a5f3
+Revises: 3f1c2a9b7d10
+Create Date: 2026-10-18 11:00:00.000000
+
+"""
+import sqlalchemy as sa
+
+from CTFd.plugins.migrations import get_all_tables, get_columns_for_table
+
+# revision identifiers, used by Alembic.
+revision = "8c4e6d21a5f3"
+down_revision = "3f1c2a9b7d10"
+branch_labels = None
+depends_on = None
+
+
+def upgrade(op=None):
+    if "container_challenge_model" not in get_all_tables(op=op):
+        return
+
+    columns = get_columns_for_table(
+        op=op, table_name="container_challenge_model", names_only=True
+    )
+    if "warm_pool_size" not in columns:
+        op.add_column(
+            "container_challenge_model",
+            sa.Column("warm_pool_size", sa.Integer(), nullable=True),
+        )
+
+
+def downgrade(op=None):
+    op.drop_column("container_challenge_model", "warm_pool_size")
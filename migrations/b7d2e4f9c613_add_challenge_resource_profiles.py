@@ -0,0 +1,45 @@
+"""Add resource profiles to container challenges
+
+Revision ID: b7d2e4f9c613
+Revises: 5a9e0c7f3b24
+Create Date: 2026-10-18 19:00:00.000000
+
+"""
+import sqlalchemy as sa
+
+from CTFd.plugins.migrations import get_all_tables, get_columns_for_table
+
+# revision identifiers, used by Alembic.
+revision = "b7d2e4f9c613"
+down_revision = "5a9e0c7f3b24"
+branch_labels = None
+depends_on = None
+
+RESOURCE_COLUMNS = (
+    ("memory_limit", sa.Integer),
+    ("cpu_limit", sa.Float),
+    ("pids_limit", sa.Integer),
+    ("ulimits", sa.Text),
+    ("tmpfs", sa.Text),
+    ("storage_limit", sa.Integer),
+)
+
+
+def upgrade(op=None):
+    if "container_challenge_model" not in get_all_tables(op=op):
+        return
+
+    columns = get_columns_for_table(
+        op=op, table_name="container_challenge_model", names_only=True
+    )
+    for name, column_type in RESOURCE_COLUMNS:
+        if name not in columns:
+            op.add_column(
+                "container_challenge_model",
+                sa.Column(name, column_type(), nullable=True),
+            )
+
+
+def downgrade(op=None):
+    for name, _ in reversed(RESOURCE_COLUMNS):
+        op.drop_column("container_challenge_model", name)
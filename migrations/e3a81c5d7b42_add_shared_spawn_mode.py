@@ -0,0 +1,42 @@
+"""Add the shared spawn mode to container challenges
+
+Revision ID: e3a81c5d7b42
+Revises: b7d2e4f9c613
+Create Date: 2026-10-18 20:00:00.000000
+
+"""
+import sqlalchemy as sa
+
+from CTFd.plugins.migrations import get_all_tables, get_columns_for_table
+
+# revision identifiers, used by Alembic.
+revision = "e3a81c5d7b42"
+down_revision = "b7d2e4f9c613"
+branch_labels = None
+depends_on = None
+
+SHARED_MODE_COLUMNS = (
+    ("spawn_mode", sa.Text),
+    ("replicas", sa.Integer),
+    ("replica_teams", sa.Integer),
+)
+
+
+def upgrade(op=None):
+    if "container_challenge_model" not in get_all_tables(op=op):
+        return
+
+    columns = get_columns_for_table(
+        op=op, table_name="container_challenge_model", names_only=True
+    )
+    for name, column_type in SHARED_MODE_COLUMNS:
+        if name not in columns:
+            op.add_column(
+                "container_challenge_model",
+                sa.Column(name, column_type(), nullable=True),
+            )
+
+
+def downgrade(op=None):
+    for name, _ in reversed(SHARED_MODE_COLUMNS):
+        op.drop_column("container_challenge_model", name)
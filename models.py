@@ -24,6 +24,20 @@ class ContainerChallengeModel(Challenges):
     minimum = db.Column(db.Integer, default=0)
     decay = db.Column(db.Integer, default=0)
     server = db.Column(db.Text, default="")
+    # Number of idle containers kept pre-started for this challenge (0 disables the warm pool)
+    warm_pool_size = db.Column(db.Integer, default=0)
+    # Resource profile of each container, NULL memory and CPU limits fall back to the global settings
+    memory_limit = db.Column(db.Integer, nullable=True)  # MB
+    cpu_limit = db.Column(db.Float, nullable=True)  # CPUs
+    pids_limit = db.Column(db.Integer, nullable=True)
+    ulimits = db.Column(db.Text, nullable=True)  # JSON, e.g. {"nofile": [1024, 2048]}
+    tmpfs = db.Column(db.Text, nullable=True)  # JSON, e.g. {"/tmp": "size=64m"}
+    storage_limit = db.Column(db.Integer, nullable=True)  # MB of writable layer
+    # "team" starts a container per team (or user), "shared" hands out leases on up to replicas containers,
+    # one more replica for every replica_teams teams (all replicas at once when empty)
+    spawn_mode = db.Column(db.Text, default="team")
+    replicas = db.Column(db.Integer, nullable=True)
+    replica_teams = db.Column(db.Integer, nullable=True)
     def __init__(self, *args, **kwargs):
         super(ContainerChallengeModel, self).__init__(**kwargs)
         self.value = kwargs["initial"]
@@ -31,6 +45,13 @@ class ContainerChallengeModel(Challenges):
 
 class ContainerInfoModel(db.Model):
     __mapper_args__ = {"polymorphic_identity": "container_info"}
+    # Every user route looks containers up by owner and challenge, user_id first also serves the quota count
+    __table_args__ = (
+        db.Index("ix_container_info_model_user_challenge", "user_id", "challenge_id"),
+        db.Index("ix_container_info_model_team_challenge", "team_id", "challenge_id"),
+        # MySQL can only index a prefix of a TEXT column
+        db.Index("ix_container_info_model_server", "server", mysql_length=255),
+    )
     container_id = db.Column(db.String(512), primary_key=True)
     challenge_id = db.Column(
         db.Integer, db.ForeignKey("challenges.id", ondelete="CASCADE")
@@ -45,12 +66,85 @@ class ContainerInfoModel(db.Model):
     ssh_username = db.Column(db.Text, nullable=True)
     ssh_password = db.Column(db.Text, nullable=True)
     timestamp = db.Column(db.Integer)
-    expires = db.Column(db.Integer)
+    expires = db.Column(db.Integer, index=True)
     team = relationship("Teams", foreign_keys=[team_id])
     user = relationship("Users", foreign_keys=[user_id])
     challenge = relationship(ContainerChallengeModel,
                              foreign_keys=[challenge_id])
     server = db.Column(db.Text, default="")
+class ContainerPoolModel(db.Model):
+    __mapper_args__ = {"polymorphic_identity": "container_pool"}
+    container_id = db.Column(db.String(512), primary_key=True)
+    challenge_id = db.Column(
+        db.Integer, db.ForeignKey("challenges.id", ondelete="CASCADE"), index=True
+    )
+    image = db.Column(db.Text)
+    port = db.Column(db.Integer)
+    server = db.Column(db.Text, default="")
+    timestamp = db.Column(db.Integer)
+class ContainerReplicaModel(db.Model):
+    __mapper_args__ = {"polymorphic_identity": "container_replica"}
+    # Containers of shared challenges, draining ones get no new leases and are killed once unused
+    container_id = db.Column(db.String(512), primary_key=True)
+    challenge_id = db.Column(
+        db.Integer, db.ForeignKey("challenges.id", ondelete="CASCADE"), index=True
+    )
+    port = db.Column(db.Integer)
+    server = db.Column(db.Text, default="")
+    draining = db.Column(db.Boolean, default=False)
+    timestamp = db.Column(db.Integer)
+class ContainerLeaseModel(db.Model):
+    __mapper_args__ = {"polymorphic_identity": "container_lease"}
+    # A team's (or user's) use of a shared challenge replica, the number of leases is the replica's load
+    __table_args__ = (
+        db.Index("ix_container_lease_model_user_challenge", "user_id", "challenge_id"),
+        db.Index("ix_container_lease_model_team_challenge", "team_id", "challenge_id"),
+    )
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    container_id = db.Column(db.String(512), index=True)
+    challenge_id = db.Column(
+        db.Integer, db.ForeignKey("challenges.id", ondelete="CASCADE")
+    )
+    team_id = db.Column(
+        db.Integer, db.ForeignKey("teams.id", ondelete="CASCADE")
+    )
+    user_id = db.Column(
+        db.Integer, db.ForeignKey("users.id", ondelete="CASCADE")
+    )
+    timestamp = db.Column(db.Integer)
+    expires = db.Column(db.Integer, index=True)
+class ContainerJobModel(db.Model):
+    __mapper_args__ = {"polymorphic_identity": "container_job"}
+    id = db.Column(db.String(64), primary_key=True)
+    kind = db.Column(db.String(32), default="spawn")
+    status = db.Column(db.String(32), default="queued")
+    challenge_id = db.Column(
+        db.Integer, db.ForeignKey("challenges.id", ondelete="CASCADE")
+    )
+    team_id = db.Column(
+        db.Integer, db.ForeignKey("teams.id", ondelete="CASCADE")
+    )
+    user_id = db.Column(
+        db.Integer, db.ForeignKey("users.id", ondelete="CASCADE")
+    )
+    result = db.Column(db.Text, nullable=True)
+    result_code = db.Column(db.Integer, nullable=True)
+    timestamp = db.Column(db.Integer, index=True)
+class ContainerSpawnLockModel(db.Model):
+    __mapper_args__ = {"polymorphic_identity": "container_spawn_lock"}
+    # One row per challenge and team (or user) while a spawn for it is in flight, the primary key makes
+    # taking the lock atomic across CTFd workers
+    key = db.Column(db.String(128), primary_key=True)
+    job_id = db.Column(db.String(64))
+    timestamp = db.Column(db.Integer, index=True)
+class ContainerEventModel(db.Model):
+    __mapper_args__ = {"polymorphic_identity": "container_event"}
+    # Append-only log of container changes, read by every worker to stream them to open dashboards
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    kind = db.Column(db.String(32))
+    container_id = db.Column(db.String(512))
+    data = db.Column(db.Text, nullable=True)
+    timestamp = db.Column(db.Integer, index=True)
 class ContainerSettingsModel(db.Model):
     __mapper_args__ = {"polymorphic_identity": "container_settings"}
     key = db.Column(db.String(512), primary_key=True)
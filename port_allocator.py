@@ -0,0 +1,58 @@
+import random
+import threading
+from collections import deque
+
+
+class PortAllocator:
+    """
+    Hands out host ports on a single Docker server from a configured range.
+
+    Free ports are kept in a shuffled deque so reserving and releasing a port is O(1). Each CTFd worker
+    process has its own allocator; the shuffle makes it unlikely that two workers pick the same port, and
+    when they do Docker refuses the second bind, after which the caller marks the port as used and retries.
+    """
+    def __init__(self, start: int, end: int):
+        self.start = start
+        self.end = end
+        self.lock = threading.Lock()
+        self.free = deque()
+        self.used = set()
+        self.pending = set()
+
+    def seed(self, used_ports: "set[int]") -> None:
+        """Rebuild the free list from the ports currently published on the server."""
+        with self.lock:
+            self.used = {port for port in used_ports if self.start <= port <= self.end} | self.pending
+            free = [port for port in range(self.start, self.end + 1) if port not in self.used]
+            random.shuffle(free)
+            self.free = deque(free)
+
+    def reserve(self) -> "int|None":
+        """Take a free port, or return None when the range is exhausted."""
+        with self.lock:
+            while self.free:
+                port = self.free.popleft()
+                # Ports marked as used after a collision are skipped lazily instead of searched for
+                if port not in self.used:
+                    self.used.add(port)
+                    self.pending.add(port)
+                    return port
+            return None
+
+    def confirm(self, port: int) -> None:
+        """The container using this port was created, so a reseed may rely on Docker reporting it."""
+        with self.lock:
+            self.pending.discard(port)
+
+    def mark_used(self, port: int) -> None:
+        """Record a port that turned out to be taken by something this allocator did not know about."""
+        with self.lock:
+            self.used.add(port)
+            self.pending.discard(port)
+
+    def release(self, port: int) -> None:
+        with self.lock:
+            self.pending.discard(port)
+            if port in self.used:
+                self.used.remove(port)
+                self.free.append(port)